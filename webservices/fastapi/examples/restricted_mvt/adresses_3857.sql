@@ -0,0 +1,16 @@
+-- Keeps a Web Mercator copy of every address point next to the original geometry, so the
+-- tile service can cut tiles without transforming each row on every request. The service
+-- detects the column at startup and falls back to on-the-fly transformation without it.
+--
+--   psql -d gis -f adresses_3857.sql
+--
+-- Generated columns need Postgres >= 12. They're kept up to date on every insert and update.
+
+ALTER TABLE public.adresses
+    ADD COLUMN IF NOT EXISTS geom_3857 geometry(Geometry, 3857)
+    GENERATED ALWAYS AS (ST_Transform(wkb_geometry, 3857)) STORED;
+
+CREATE INDEX IF NOT EXISTS adresses_geom_3857_idx ON public.adresses USING gist (geom_3857);
+CREATE INDEX IF NOT EXISTS adresses_plz_idx ON public.adresses (plz);
+
+ANALYZE public.adresses;
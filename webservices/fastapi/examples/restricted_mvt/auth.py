@@ -1,58 +1,120 @@
-from functools import lru_cache
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
 
-import jwt
 from fastapi import HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
-from sqlmodel import Session, select
 from starlette.requests import Request
 
-from engine import engine
-from models import Users
+from backpressure import AcquireQueue
+from engine import DB_POOL_ACQUIRE_TIMEOUT
+from jwtoken import decode_token
+from permissions import MISSING, PermissionCache
+
+TOKEN_CACHE_MAX_ITEMS = int(os.environ.get("TOKEN_CACHE_MAX_ITEMS", 100000))
 
 
 class TokenPayload(BaseModel):
     sub: str = None
     exp: int = None
+    iat: int = 0  # tokens from before this claim count as issued before any change
+    type: str = "access"  # tokens from before there were refresh tokens are access tokens
+    plz: Optional[str] = None
+
+
+class Permission(BaseModel):
+    user: str
+    plz: str  # the permission group: everyone with the same postal code sees the same tiles
+
+
+class TokenCache:
+    """
+    Bounded LRU of already verified tokens, each kept until it expires.
+
+    Only valid tokens are cached, so garbage tokens can't push the valid ones out.
+    """
+
+    def __init__(self, max_items: int = TOKEN_CACHE_MAX_ITEMS):
+        self.max_items = max_items
+        self._tokens: "OrderedDict[str, TokenPayload]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[TokenPayload]:
+        if (payload := self._tokens.get(token)) is None or payload.exp <= time.time():
+            self._tokens.pop(token, None)
+            self.misses += 1
+            return None
+
+        self._tokens.move_to_end(token)
+        self.hits += 1
+        return payload
+
+    def set(self, token: str, payload: TokenPayload):
+        self._tokens[token] = payload
+        while len(self._tokens) > self.max_items:
+            self._tokens.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"size": len(self._tokens), "hits": self.hits, "misses": self.misses}
+
+
+tokens = TokenCache()
 
 
 class Authorizer(HTTPBearer):
-    def __init__(self, auto_error=True):
+    def __init__(self, token_type: str = "access", auto_error=True):
         super(Authorizer, self).__init__(auto_error=auto_error)
-        self.user = None
+        self.token_type = token_type
 
     async def __call__(self, request: Request):
         creds: HTTPAuthorizationCredentials = await super(Authorizer, self).__call__(request)
         if not creds or not creds.scheme == "Bearer":
             raise HTTPException(status_code=403, detail="Invalid authentication scheme.")
 
-        if not (token := self.verify_jwt(creds.credentials)):
+        if not (token := self.verify_jwt(creds.credentials)) or token.type != self.token_type:
             raise HTTPException(status_code=403, detail="Invalid token or expired token.")
 
-        self.user = token.sub
-        return self
+        # one Authorizer instance serves all requests, so the result must not be kept on self
+        state = request.app.state
+        if token.plz and not state.permissions.changed_since(token.sub, token.iat):
+            # access tokens carry the postal code, no database access needed, unless the user
+            # changed since the token was issued
+            return Permission(user=token.sub, plz=token.plz)
+
+        if not (plz := await get_user_info(state.pool, state.pool_queue, state.permissions, token.sub)):
+            raise HTTPException(status_code=403, detail="User has no access to any data.")
+
+        return Permission(user=token.sub, plz=plz)
 
     @staticmethod
     def verify_jwt(jwtoken):
+        if (payload := tokens.get(jwtoken)) is not None:
+            return payload
+
         try:
-            payload = jwt.decode(
-                jwtoken,
-                "SUPER_SECRET_KEY",
-                algorithms=["HS256"],
-            )
-            return TokenPayload(**payload)
+            payload = TokenPayload(**decode_token(jwtoken))
         except Exception:
             return False
 
-    def get_user_info(self):
-        return get_user_info(self.user)
+        if payload.exp is not None:
+            tokens.set(jwtoken, payload)
+        return payload
 
 
-@lru_cache
-def get_user_info(username):
-    with Session(engine) as session:
-        postal_code = session.exec(
-            select(Users.plz).where(Users.username == username)
-        ).first()
+async def get_user_info(pool, queue: AcquireQueue, cache: PermissionCache, username) -> Optional[str]:
+    # the lookup runs on the same asyncpg pool as the tile queries, without blocking the event loop,
+    # and queues up for a connection just like them
+    if (postal_code := cache.get(username)) is MISSING:
+        with queue.enter():
+            conn = await pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT)
+        try:
+            postal_code = await conn.fetchval("SELECT plz FROM users WHERE username = $1", username)
+        finally:
+            await pool.release(conn)
+        cache.set(username, postal_code)
 
-        return postal_code
+    return postal_code
@@ -0,0 +1,50 @@
+import asyncio
+from contextlib import contextmanager
+
+from fastapi import HTTPException
+from starlette import status
+
+# seconds, for the Retry-After header of rejected requests
+RETRY_AFTER = 1
+
+
+def overloaded(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=detail,
+        headers={"Retry-After": str(RETRY_AFTER)},
+    )
+
+
+class AcquireQueue:
+    """
+    Counts the requests waiting for a pool connection, and turns away those beyond `max_queue`.
+
+    Without a limit, every request of a traffic spike queues up for a connection, and all of
+    them get slower. Instead, the ones over the limit get a 503 right away, and clients retry.
+    """
+
+    def __init__(self, max_queue: int):
+        self.max_queue = max_queue
+        self.waiting = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @contextmanager
+    def enter(self):
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise overloaded("Too many requests waiting for the database.")
+
+        self.waiting += 1
+        try:
+            yield
+        except asyncio.TimeoutError:
+            # the pool's acquire timeout
+            self.timed_out += 1
+            raise overloaded("Timed out waiting for the database.")
+        finally:
+            self.waiting -= 1
+
+    def stats(self) -> dict:
+        return {"waiting": self.waiting, "rejected": self.rejected, "timed_out": self.timed_out}
@@ -0,0 +1,100 @@
+"""
+Compares the per-request latency of the tile query built with str.format (one query text,
+and therefore one parse and plan, per postal code) against the parameterised tile query,
+which asyncpg prepares once per connection. If the table has the precomputed Web Mercator
+column (see adresses_3857.sql), the prepared query is timed against it as well.
+
+    python bench_query.py --requests 500 --zoom 14
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from buildpg import asyncpg
+
+from engine import DATABASE_URL
+from layers import LAYERS, inspect_layers
+from tiles import fetch_tile, tms
+
+BERLIN_BBOX = (13.08, 52.33, 13.76, 52.68)
+
+LEGACY_QUERY = """
+SELECT ST_AsMVT(mvtgeom.*) FROM (
+    SELECT ST_asmvtgeom(ST_Transform(t.geom, 3857), bounds.geom) AS geom, t.objectid
+        FROM ( SELECT objectid, wkb_geometry as geom FROM public.adresses WHERE plz = '{plz}') t,
+             (SELECT ST_MakeEnvelope(:xmin, :ymin, :xmax, :ymax, :epsg) as geom) bounds
+        WHERE ST_Intersects(t.geom, ST_Transform(bounds.geom, 4326))
+     ) mvtgeom;
+"""
+
+
+async def fetch_tile_legacy(conn, tile, plz):
+    bbox = tms.xy_bounds(tile)
+    p = {
+        "xmin": bbox.left,
+        "ymin": bbox.bottom,
+        "xmax": bbox.right,
+        "ymax": bbox.top,
+        "epsg": tms.crs.to_epsg(),
+    }
+    return bytes(await conn.fetchval_b(LEGACY_QUERY.format(plz=plz), **p))
+
+
+async def fetch_tile_prepared(conn, tile, plz):
+    return await fetch_tile(conn, tile, [LAYERS["adresses"]._replace(mercator=False)], plz)
+
+
+async def fetch_tile_mercator(conn, tile, plz):
+    return await fetch_tile(conn, tile, [LAYERS["adresses"]._replace(mercator=True)], plz)
+
+
+async def timed(fn, conn, requests):
+    timings = []
+    for tile, plz in requests:
+        start = time.perf_counter()
+        await fn(conn, tile, plz)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    print(
+        f"{name:>10}: mean {statistics.mean(timings):7.2f} ms | "
+        f"p50 {timings[len(timings) // 2]:7.2f} ms | "
+        f"p95 {timings[int(len(timings) * 0.95)]:7.2f} ms"
+    )
+
+
+async def main(args):
+    pool = await asyncpg.create_pool_b(args.dsn, min_size=1, max_size=1)
+    async with pool.acquire() as conn:
+        plzs = [r["plz"] for r in await conn.fetch("SELECT DISTINCT plz FROM public.adresses")]
+
+        tiles = list(tms.tiles(*BERLIN_BBOX, [args.zoom]))
+        rnd = random.Random(args.seed)
+        requests = [(rnd.choice(tiles), rnd.choice(plzs)) for _ in range(args.requests)]
+
+        # warm up shared buffers, so neither variant pays for cold reads
+        await timed(fetch_tile_prepared, conn, requests[:20])
+
+        report("formatted", await timed(fetch_tile_legacy, conn, requests))
+        report("prepared", await timed(fetch_tile_prepared, conn, requests))
+
+        if (await inspect_layers(conn, [LAYERS["adresses"]]))["adresses"].mercator:
+            report("mercator", await timed(fetch_tile_mercator, conn, requests))
+
+    await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=DATABASE_URL)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--zoom", type=int, default=14)
+    parser.add_argument("--seed", type=int, default=42)
+
+    asyncio.run(main(parser.parse_args()))
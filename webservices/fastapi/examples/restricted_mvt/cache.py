@@ -0,0 +1,221 @@
+import asyncio
+import gzip
+import hashlib
+import os
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, without it tiles are offered gzipped only
+    brotli = None
+
+TILE_CACHE_DIR = os.environ.get("TILE_CACHE_DIR", "tile_cache")
+TILE_CACHE_MAX_ITEMS = int(os.environ.get("TILE_CACHE_MAX_ITEMS", 10000))
+TILE_CACHE_MAX_BYTES = int(os.environ.get("TILE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+TILE_CACHE_TTL = int(os.environ.get("TILE_CACHE_TTL", 60 * 60))
+# the disk level is pruned every TILE_CACHE_PRUNE_EVERY writes: expired tiles are deleted, then
+# the ones expiring soonest until it is below 90% of TILE_CACHE_DIR_MAX_BYTES
+TILE_CACHE_DIR_MAX_BYTES = int(os.environ.get("TILE_CACHE_DIR_MAX_BYTES", 1024 * 1024 * 1024))
+TILE_CACHE_PRUNE_EVERY = int(os.environ.get("TILE_CACHE_PRUNE_EVERY", 1000))
+# tiles are compressed while their request waits, brotli's highest qualities take far too long for that
+TILE_BROTLI_QUALITY = int(os.environ.get("TILE_BROTLI_QUALITY", 5))
+
+TileKey = Tuple[str, str, int, int, int]  # (permission group, layers, z, x, y)
+
+# content-encoding -> (compress function, file suffix), in order of preference
+ENCODINGS = {"gzip": (lambda content: gzip.compress(content, compresslevel=9), ".gz")}
+if brotli is not None:
+    ENCODINGS = {"br": (lambda content: brotli.compress(content, quality=TILE_BROTLI_QUALITY), ".br"), **ENCODINGS}
+
+
+class CachedTile(NamedTuple):
+    content: bytes
+    etag: str
+    expires: float
+    encoded: Dict[str, bytes]  # content-encoding -> compressed content
+
+    @property
+    def size(self) -> int:
+        return len(self.content) + sum(len(v) for v in self.encoded.values())
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        # every representation needs its own strong ETag
+        return self.etag if encoding is None else f'{self.etag[:-1]}-{encoding}"'
+
+
+def make_etag(content: bytes) -> str:
+    return '"{}"'.format(hashlib.blake2b(content, digest_size=16).hexdigest())
+
+
+def encode(content: bytes) -> Dict[str, bytes]:
+    encoded = {}
+    for encoding, (compress, _) in ENCODINGS.items():
+        # tiny tiles can grow when compressed, these are only served as they are
+        if len(compressed := compress(content)) < len(content):
+            encoded[encoding] = compressed
+
+    return encoded
+
+
+def make_cached(content: bytes, ttl: int) -> CachedTile:
+    return CachedTile(content, make_etag(content), time.time() + ttl, encode(content))
+
+
+class TileCache:
+    """
+    Two-level tile cache: an in-memory LRU in front of an on-disk store.
+
+    Both levels drop tiles older than `ttl` seconds. A tile file's mtime is
+    its expiry time, so tiles written with another `ttl`, e.g. by the seeder,
+    keep theirs. The memory level is bounded by item count and total bytes,
+    the disk level by its total bytes, which is checked every `prune_every`
+    writes, in the background.
+    """
+
+    def __init__(
+        self,
+        directory: str = TILE_CACHE_DIR,
+        max_items: int = TILE_CACHE_MAX_ITEMS,
+        max_bytes: int = TILE_CACHE_MAX_BYTES,
+        ttl: int = TILE_CACHE_TTL,
+        disk_max_bytes: int = TILE_CACHE_DIR_MAX_BYTES,
+        prune_every: int = TILE_CACHE_PRUNE_EVERY,
+    ):
+        self.directory = Path(directory)
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_max_bytes = disk_max_bytes
+        self.prune_every = prune_every
+
+        self._memory: "OrderedDict[TileKey, CachedTile]" = OrderedDict()
+        self._memory_bytes = 0
+
+        self._writes = 0
+        # kept until done, the event loop only holds a weak reference to the task
+        self._pruning: Optional[asyncio.Future] = None
+
+    async def get(self, key: TileKey) -> Optional[CachedTile]:
+        if (cached := self._get_memory(key)) is not None:
+            return cached
+
+        if (cached := await run_in_threadpool(self._read_disk, key)) is not None:
+            self._set_memory(key, cached)
+
+        return cached
+
+    async def set(self, key: TileKey, content: bytes, persist: bool = True) -> CachedTile:
+        # compress once here, instead of on every response
+        cached = await run_in_threadpool(make_cached, content, self.ttl)
+        self._set_memory(key, cached)
+        if persist:
+            await run_in_threadpool(self._write_disk, key, cached)
+            self._writes += 1
+            if self._writes % self.prune_every == 0 and (self._pruning is None or self._pruning.done()):
+                # walking the directory takes a while, the request doesn't wait for it
+                self._pruning = asyncio.ensure_future(run_in_threadpool(self.prune))
+
+        return cached
+
+    @staticmethod
+    def _expired(expires: float) -> bool:
+        return expires < time.time()
+
+    def _get_memory(self, key: TileKey) -> Optional[CachedTile]:
+        if (cached := self._memory.get(key)) is None:
+            return None
+
+        if self._expired(cached.expires):
+            self._pop_memory(key)
+            return None
+
+        self._memory.move_to_end(key)
+        return cached
+
+    def _set_memory(self, key: TileKey, cached: CachedTile):
+        if cached.size > self.max_bytes:
+            return
+
+        self._pop_memory(key)
+        self._memory[key] = cached
+        self._memory_bytes += cached.size
+
+        while len(self._memory) > self.max_items or self._memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.size
+
+    def _pop_memory(self, key: TileKey):
+        if (cached := self._memory.pop(key, None)) is not None:
+            self._memory_bytes -= cached.size
+
+    def _path(self, key: TileKey) -> Path:
+        group, layers, z, x, y = key
+        return self.directory / str(group) / layers / str(z) / str(x) / f"{y}.pbf"
+
+    def _read_disk(self, key: TileKey) -> Optional[CachedTile]:
+        path = self._path(key)
+        variants = {encoding: path.with_name(path.name + suffix) for encoding, (_, suffix) in ENCODINGS.items()}
+        try:
+            expires = path.stat().st_mtime
+            if self._expired(expires):
+                for p in (path, *variants.values()):
+                    p.unlink(missing_ok=True)
+                return None
+            content = path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+        encoded = {}
+        for encoding, variant in variants.items():
+            try:
+                encoded[encoding] = variant.read_bytes()
+            except FileNotFoundError:
+                pass
+
+        return CachedTile(content, make_etag(content), expires, encoded)
+
+    def _write_disk(self, key: TileKey, cached: CachedTile):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # the compressed variants live next to the raw tile, which is written last: once it
+        # exists, so do its variants
+        for encoding, content in cached.encoded.items():
+            self._write_file(path.with_name(path.name + ENCODINGS[encoding][1]), content, cached.expires)
+        self._write_file(path, cached.content, cached.expires)
+
+    @staticmethod
+    def _write_file(path: Path, content: bytes, expires: float):
+        # write to a temporary file first, so readers never see half a tile
+        tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+        tmp.write_bytes(content)
+        os.utime(tmp, (expires, expires))
+        os.replace(tmp, path)
+
+    def prune(self):
+        """Delete expired tiles, then the ones expiring soonest until the disk level is below 90% of disk_max_bytes."""
+        files = []
+        for path in self.directory.rglob("*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.is_file():
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for expires, size, path in sorted(files):
+            if path.suffix == ".tmp":
+                # still being written, unless left over for longer than a tile lives
+                if not self._expired(expires + self.ttl):
+                    continue
+            elif not self._expired(expires) and total <= self.disk_max_bytes * 0.9:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
@@ -1,5 +1,12 @@
-from sqlmodel import create_engine
+import os
 
-DATABASE_URL = "postgresql://<user>:<password>@localhost:5452/gis"
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql://<user>:<password>@localhost:5452/gis")
 
-engine = create_engine(DATABASE_URL, echo=True)
+# the asyncpg pool of the tile service, see main.startup_event()
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 10))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 10))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.environ.get("DB_POOL_ACQUIRE_TIMEOUT", 5))  # seconds
+# requests waiting for a connection beyond this many are turned away right away
+DB_POOL_MAX_QUEUE = int(os.environ.get("DB_POOL_MAX_QUEUE", 100))
+DB_POOL_CLOSE_TIMEOUT = float(os.environ.get("DB_POOL_CLOSE_TIMEOUT", 10))  # seconds
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", 10000))
@@ -1,17 +1,40 @@
+import os
 from datetime import datetime, timedelta
+from typing import Optional
 
 import jwt
 
+# read once at import, not on every token
+JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "SUPER_SECRET_KEY")
+JWT_ALGORITHM = "HS256"
+ACCESS_TOKEN_MINUTES = int(os.environ.get("ACCESS_TOKEN_MINUTES", 30))
+REFRESH_TOKEN_MINUTES = int(os.environ.get("REFRESH_TOKEN_MINUTES", 60 * 24))
 
-def create_token(user: str, refresh: bool = False) -> str:
+
+def create_token(user: str, refresh: bool = False, *, plz: Optional[str] = None) -> str:
+    """
+    Access tokens carry the user's postal code, so requests can be authorized without a lookup.
+    Refresh tokens only carry the user: the postal code is looked up again when refreshing.
+
+    Every token records when it was issued, so the postal code of users changed since then is
+    looked up again instead, see auth.Authorizer.
+    """
     minutes = (
-        30
+        ACCESS_TOKEN_MINUTES
         if not refresh
-        else 60 * 24
+        else REFRESH_TOKEN_MINUTES
     )
-    expires_delta = datetime.utcnow() + timedelta(minutes=minutes)
+    issued = datetime.utcnow()
+    expires_delta = issued + timedelta(minutes=minutes)
 
-    to_encode = {"exp": expires_delta, "sub": user}
-    encoded_jwt = jwt.encode(to_encode, "SUPER_SECRET_KEY", algorithm="HS256")
+    to_encode = {"exp": expires_delta, "iat": issued, "sub": user, "type": "refresh" if refresh else "access"}
+    if plz is not None and not refresh:
+        to_encode["plz"] = plz
+    encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
 
     return encoded_jwt
+
+
+def decode_token(token: str) -> dict:
+    """The token's claims, raises jwt.InvalidTokenError if it is invalid or expired."""
+    return jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
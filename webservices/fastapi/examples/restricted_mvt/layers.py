@@ -0,0 +1,76 @@
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+
+
+class Layer(NamedTuple):
+    name: str  # the layer's name in the URL, and in the MVT unless mvt_layer is set
+    table: str  # schema qualified
+    geometry_column: str = "wkb_geometry"
+    id_column: str = "ogc_fid"  # ogr2ogr's default primary key
+    attributes: Tuple[str, ...] = ()
+    minzoom: int = 0
+    maxzoom: int = 25
+    permission_column: Optional[str] = None  # None: everyone sees all of it
+    cluster: bool = False  # points only: cluster at low zoom levels, see tiles.ZoomConfig
+    # if the table has this column, holding the geometries already transformed to Web Mercator
+    # and indexed (see adresses_3857.sql), tiles are cut from it directly
+    mercator_column: str = "geom_3857"
+    mercator: bool = False  # whether mercator_column exists, set by inspect_layers()
+    mvt_layer: Optional[str] = None  # the layer's name inside the MVT, if not `name`
+
+    @property
+    def mvt_name(self) -> str:
+        return self.mvt_layer or self.name
+
+
+LAYERS: Dict[str, Layer] = {
+    layer.name: layer
+    for layer in (
+        Layer(
+            "adresses",
+            "public.adresses",
+            id_column="objectid",
+            attributes=("objectid",),
+            permission_column="plz",
+            cluster=True,
+            # the name ST_AsMVT gives a layer by default, which existing map styles reference
+            mvt_layer="default",
+        ),
+        # the district boundaries next to this file, if loaded with
+        # ogr2ogr -f PostgreSQL PG:"..." bezirke.geojson -nln bezirke
+        Layer("bezirke", "public.bezirke", attributes=("name",)),
+    )
+}
+
+
+async def inspect_layers(conn, layers: Iterable[Layer] = LAYERS.values()) -> Dict[str, Layer]:
+    """The layers whose tables exist, with their `mercator` flag resolved."""
+    available = {}
+    for layer in layers:
+        schema, table = layer.table.split(".")
+        columns = {
+            r["column_name"]
+            for r in await conn.fetch(
+                "SELECT column_name FROM information_schema.columns WHERE table_schema = $1 AND table_name = $2",
+                schema,
+                table,
+            )
+        }
+        if layer.geometry_column in columns:
+            available[layer.name] = layer._replace(mercator=layer.mercator_column in columns)
+
+    return available
+
+
+def parse_layers(names: str, available: Dict[str, Layer]) -> Tuple[Layer, ...]:
+    """Resolve a comma separated list of layer names, like 'adresses,bezirke'."""
+    try:
+        return tuple(available[name] for name in dict.fromkeys(names.split(",")))
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"Unknown layer {e}.")
+
+
+def permission_group(layers: Iterable[Layer], plz: str) -> str:
+    """What a tile of these layers depends on: the postal code, unless all layers are public."""
+    return plz if any(layer.permission_column for layer in layers) else "public"
@@ -0,0 +1,96 @@
+"""
+Measures login throughput and tile latency against a running tile service, first with tile
+requests only, then while logins are hammering the service at the same time.
+
+    uvicorn main:vectortile_app --port 8001 --workers 1
+    python loadtest.py --url http://localhost:8001 --user user_10365 --user user_10115
+
+Needs httpx (pip install httpx).
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import httpx
+
+from tiles import tms
+
+BERLIN_BBOX = (13.08, 52.33, 13.76, 52.68)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def login(client, user, password):
+    r = await client.post("/login", json={"username": user, "password": password})
+    r.raise_for_status()
+    return r.json()["token"]
+
+
+async def tile_worker(client, token, tiles, rnd, deadline, latencies):
+    headers = {"Authorization": f"Bearer {token}", "Accept-Encoding": "gzip"}
+    while time.perf_counter() < deadline:
+        tile = rnd.choice(tiles)
+        start = time.perf_counter()
+        r = await client.get(f"/adresses/{tile.z}/{tile.x}/{tile.y}/", headers=headers)
+        r.raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+async def login_worker(client, users, password, rnd, deadline, logins):
+    while time.perf_counter() < deadline:
+        await login(client, rnd.choice(users), password)
+        logins.append(time.perf_counter())
+
+
+async def run(args, with_logins):
+    rnd = random.Random(args.seed)
+    tiles = list(tms.tiles(*BERLIN_BBOX, range(args.minzoom, args.maxzoom + 1)))
+    limits = httpx.Limits(max_connections=args.tile_clients + args.login_clients)
+
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+        tokens = [await login(client, user, args.password) for user in args.user]
+
+        latencies, logins = [], []
+        deadline = time.perf_counter() + args.duration
+        workers = [
+            tile_worker(client, rnd.choice(tokens), tiles, random.Random(rnd.random()), deadline, latencies)
+            for _ in range(args.tile_clients)
+        ]
+        if with_logins:
+            workers += [
+                login_worker(client, args.user, args.password, random.Random(rnd.random()), deadline, logins)
+                for _ in range(args.login_clients)
+            ]
+        await asyncio.gather(*workers)
+
+    print(
+        f"{'with logins' if with_logins else 'tiles only':>12}: "
+        f"{len(latencies) / args.duration:7.1f} tiles/s | "
+        f"tile p50 {statistics.median(latencies):7.2f} ms | p99 {percentile(latencies, 0.99):7.2f} ms | "
+        f"{len(logins) / args.duration:6.1f} logins/s"
+    )
+
+
+async def main(args):
+    await run(args, with_logins=False)
+    await run(args, with_logins=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--user", action="append", required=True, help="repeatable")
+    parser.add_argument("--password", default="123")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per run")
+    parser.add_argument("--tile-clients", type=int, default=20)
+    parser.add_argument("--login-clients", type=int, default=5)
+    parser.add_argument("--minzoom", type=int, default=12)
+    parser.add_argument("--maxzoom", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=42)
+
+    asyncio.run(main(parser.parse_args()))
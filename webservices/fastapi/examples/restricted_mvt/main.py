@@ -1,20 +1,51 @@
-import morecantile
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
 from buildpg import asyncpg
 from fastapi import FastAPI, Path, HTTPException, Depends
 from morecantile import Tile
-from sqlalchemy import func
-from sqlmodel import Session, select
 from starlette import status
 from starlette.requests import Request
-from starlette.responses import Response
+from starlette.responses import JSONResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 
 
-from auth import Authorizer
-from engine import DATABASE_URL, engine
-from models import Users, UsersReq
+import metrics
+from auth import Authorizer, Permission, tokens
+from backpressure import AcquireQueue, overloaded
+from cache import TileCache
+from mbtiles import TileArchive
+from metrics import Histogram, Timings
+from permissions import PermissionCache
+from singleflight import SingleFlight
+from layers import inspect_layers, parse_layers, permission_group
+from tiles import explain_tile, fetch_tile
+from engine import (
+    DATABASE_URL,
+    DB_POOL_ACQUIRE_TIMEOUT,
+    DB_POOL_CLOSE_TIMEOUT,
+    DB_POOL_MAX_QUEUE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MIN_SIZE,
+    DB_STATEMENT_TIMEOUT_MS,
+)
+from models import UsersReq
 from jwtoken import create_token
 
+logger = logging.getLogger(__name__)
+
+# tiles taking longer than this are logged, along with their query plan
+TILE_SLOW_MS = float(os.environ.get("TILE_SLOW_MS", 500))
+
+tile_seconds = Histogram("tile_request_seconds", "Time to serve a tile.", ["zoom"])
+tile_stage_seconds = Histogram("tile_stage_seconds", "Time spent in each stage of serving a tile.", ["stage", "zoom"])
+
+# the event loop only keeps weak references to tasks, these are kept until they are done
+background_tasks = set()
+
 origins = [
     "http://localhost",
     "http://localhost:5173",
@@ -36,7 +67,94 @@ vectortile_app.add_middleware(
 async def startup_event():
     vectortile_app.state.pool = await asyncpg.create_pool_b(
         DATABASE_URL,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        # a tile query running away must not hold on to its connection forever
+        server_settings={"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)},
     )
+    vectortile_app.state.pool_queue = AcquireQueue(DB_POOL_MAX_QUEUE)
+    async with vectortile_app.state.pool.acquire() as conn:
+        # the registered layers which exist in the database
+        vectortile_app.state.layers = await inspect_layers(conn)
+    vectortile_app.state.tile_cache = TileCache()
+    vectortile_app.state.tile_flights = SingleFlight()
+    vectortile_app.state.tile_archive = TileArchive()
+
+    vectortile_app.state.permissions = PermissionCache()
+    await vectortile_app.state.permissions.listen(DATABASE_URL)
+
+
+@vectortile_app.on_event("shutdown")
+async def shutdown_event():
+    vectortile_app.state.tile_archive.close()
+    await vectortile_app.state.permissions.close()
+
+    pool = vectortile_app.state.pool
+    try:
+        # lets running queries finish
+        await asyncio.wait_for(pool.close(), DB_POOL_CLOSE_TIMEOUT)
+    except asyncio.TimeoutError:
+        pool.terminate()
+
+
+@vectortile_app.exception_handler(asyncpg.QueryCanceledError)
+async def statement_timeout(request: Request, exc: asyncpg.QueryCanceledError):
+    # the statement_timeout cancelled the query, most likely because the database is overloaded
+    e = overloaded("The database took too long.")
+    return JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
+
+
+@vectortile_app.middleware("http")
+async def tile_timings(request: Request, call_next):
+    request.state.timings = timings = Timings()
+    start = time.perf_counter()
+    response = await call_next(request)
+    total = time.perf_counter() - start
+
+    # only tile requests record their tile, see get_tile()
+    if (tile := getattr(request.state, "tile", None)) is None:
+        return response
+
+    response.headers["Server-Timing"] = f"{timings.server_timing()}, total;dur={total * 1000:.1f}"
+    tile_seconds.observe(total, zoom=tile.z)
+    for stage, duration in timings.durations.items():
+        tile_stage_seconds.observe(duration, stage=stage, zoom=tile.z)
+
+    if total * 1000 > TILE_SLOW_MS:
+        # explaining needs another round trip, which the response doesn't wait for
+        task = asyncio.ensure_future(log_slow_tile(request, tile, total, timings))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+    return response
+
+
+async def log_slow_tile(request: Request, tile: Tile, total: float, timings: Timings):
+    plan = None
+    # only set if this request queried the database itself, see get_tile()
+    if (rendered := getattr(request.state, "tile_query", None)) is not None:
+        try:
+            async with request.app.state.pool.acquire() as conn:
+                plan = await explain_tile(conn, tile, *rendered)
+        except Exception:
+            logger.exception("Could not explain slow tile %s", tile)
+
+    logger.warning(
+        "Slow tile %s %s: %.1f ms (%s)%s",
+        request.url.path,
+        tile,
+        total * 1000,
+        timings.server_timing(),
+        f"\n{plan}" if plan else "",
+    )
+
+
+authorizer = Authorizer()
+
+
+async def timed_authorizer(request: Request) -> Permission:
+    with request.state.timings.stage("auth"):
+        return await authorizer(request)
 
 
 def tile_params(
@@ -44,58 +162,161 @@ def tile_params(
     x: int = Path(...),
     y: int = Path(...),
 ) -> Tile:
-    """Tile parameters."""
+    """Tile parameters, only tiles which exist at their zoom level."""
+    if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=404, detail="No such tile.")
     return Tile(x, y, z)
 
 
+def etag_matches(if_none_match, etag: str) -> bool:
+    if not if_none_match:
+        return False
+
+    candidates = [c.strip().removeprefix("W/") for c in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def negotiate_encoding(accept_encoding, available) -> Optional[str]:
+    """
+    Pick the available content-encoding the client gives the highest q-value, None for identity.
+    Among equal q-values, the first in `available` wins.
+    """
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        try:
+            q = float(params.strip().removeprefix("q=")) if params else 1.0
+        except ValueError:
+            q = 0.0
+        accepted[coding.strip().lower()] = q
+
+    best, best_q = None, 0.0
+    for encoding in available:
+        if (q := accepted.get(encoding, accepted.get("*", 0.0))) > best_q:
+            best, best_q = encoding, q
+
+    return best
+
+
 @vectortile_app.post("/login")
-def login(data: UsersReq):
-    with Session(engine) as session:
-        result = session.exec(
-            select(Users).where(
-                Users.username == data.username,
-                Users.password == func.public.crypt(data.password, Users.password),
-            )
-        ).first()
-
-    if not result:
+async def login(request: Request, data: UsersReq):
+    pool = request.app.state.pool
+    # logins wait for a connection like tile requests do, and are turned away like them
+    with request.app.state.pool_queue.enter():
+        conn = await pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT)
+    try:
+        user = await conn.fetchrow(
+            "SELECT username, plz FROM users WHERE username = $1 AND password = public.crypt($2, password)",
+            data.username,
+            data.password,
+        )
+    finally:
+        await pool.release(conn)
+
+    if not user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Wrong username or password.",
         )
 
-    return {"token": create_token(result.username)}
+    return {
+        "token": create_token(user["username"], plz=user["plz"]),
+        "refresh_token": create_token(user["username"], refresh=True),
+    }
+
 
+@vectortile_app.post("/refresh")
+def refresh(permission: Permission = Depends(Authorizer(token_type="refresh"))):
+    # the postal code was looked up again while authorizing, so changes apply from here on
+    return {"token": create_token(permission.user, plz=permission.plz)}
+
+
+@vectortile_app.get("/stats")
+def stats(request: Request):
+    return {
+        "tile_queries": request.app.state.tile_flights.stats(),
+        "permissions": request.app.state.permissions.stats(),
+        "tokens": tokens.stats(),
+        "pool": {
+            "size": request.app.state.pool.get_size(),
+            "idle": request.app.state.pool.get_idle_size(),
+            **request.app.state.pool_queue.stats(),
+        },
+    }
 
-@vectortile_app.get("/adresses/{z}/{x}/{y}/")
+
+@vectortile_app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@vectortile_app.get("/{layers}/{z}/{x}/{y}/")
 async def get_tile(
         request: Request,
-        auth_info: Authorizer = Depends(Authorizer()),
+        layers: str,  # one or more comma separated layer names, e.g. "adresses" or "adresses,bezirke"
+        permission: Permission = Depends(timed_authorizer),
         tile: Tile = Depends(tile_params),  # FastAPI magic: receives x/y/z
 ):
-    tms = morecantile.tms.get("WebMercatorQuad")
-    bbox = tms.xy_bounds(tile)
-    p = {
-        "xmin": bbox.left,
-        "ymin": bbox.bottom,
-        "xmax": bbox.right,
-        "ymax": bbox.top,
-        "epsg": tms.crs.to_epsg(),
-    }
+    requested = parse_layers(layers, request.app.state.layers)
+    # the timing middleware records this request's stages under the tile's zoom level
+    request.state.tile = tile
+    timings: Timings = request.state.timings
 
-    plz = auth_info.get_user_info()  # here, we're fetching what the user is allowed to see
+    # tiles only depend on the permission group, so all users of one postal code share cached tiles
+    plz = permission_group(requested, permission.plz)
+    layers = ",".join(layer.name for layer in requested)
 
-    q = """
-    SELECT ST_AsMVT(mvtgeom.*) FROM (
-        SELECT ST_asmvtgeom(ST_Transform(t.geom, 3857), bounds.geom) AS geom, t.objectid
-            FROM ( SELECT objectid, wkb_geometry as geom FROM public.adresses WHERE plz = '{plz}') t,
-                 (SELECT ST_MakeEnvelope(:xmin, :ymin, :xmax, :ymax, :epsg) as geom) bounds
-            WHERE ST_Intersects(t.geom, ST_Transform(bounds.geom, 4326))
-         ) mvtgeom;  
-    """.format(plz=plz)
+    cache = request.app.state.tile_cache
+    key = (plz, layers, tile.z, tile.x, tile.y)
 
-    pool = request.app.state.pool
-    async with pool.acquire() as conn:
-        content = await conn.fetchval_b(q, **p)
+    archive = request.app.state.tile_archive
+
+    async def render():
+        # low zoom levels rarely change, these are served from the MBTiles archives if possible
+        # only the request running the query records these stages, coalesced ones only wait
+        if archive.covers(tile):
+            with timings.stage("archive"):
+                content = await archive.get(plz, requested, tile)
+            if content is not None:
+                with timings.stage("encode"):
+                    return await cache.set(key, content, persist=False)
+
+        pool = request.app.state.pool
+        with timings.stage("acquire"), request.app.state.pool_queue.enter():
+            conn = await pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT)
+        try:
+            request.state.tile_query = (requested, permission.plz)
+            with timings.stage("sql"):
+                content = await fetch_tile(conn, tile, requested, permission.plz)
+        finally:
+            await pool.release(conn)
+
+        # the archives don't store empty tiles, so these still go to the disk cache
+        if archived := archive.covers(tile) and bool(content):
+            with timings.stage("archive"):
+                await archive.put(plz, requested, tile, content)
+
+        with timings.stage("encode"):
+            return await cache.set(key, content, persist=not archived)
+
+    with timings.stage("cache"):
+        cached = await cache.get(key)
+    if cached is None:
+        # identical concurrent requests (e.g. many clients opening the same map) wait on one query
+        with timings.stage("render"):
+            cached = await request.app.state.tile_flights.do(key, render)
+
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"), cached.encoded)
+    headers = {
+        "ETag": cached.etag_for(encoding),
+        "Cache-Control": f"private, max-age={cache.ttl}",
+        "Vary": "Authorization, Accept-Encoding",
+    }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if encoding is None:
+        return Response(cached.content, media_type="application/x-protobuf", headers=headers)
 
-    return Response(bytes(content), media_type="application/x-protobuf")
+    headers["Content-Encoding"] = encoding
+    return Response(cached.encoded[encoding], media_type="application/x-protobuf", headers=headers)
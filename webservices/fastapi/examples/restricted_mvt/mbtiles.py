@@ -0,0 +1,152 @@
+import gzip
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple
+
+from morecantile import Tile
+from starlette.concurrency import run_in_threadpool
+
+from layers import Layer
+
+TILE_ARCHIVE_DIR = os.environ.get("TILE_ARCHIVE_DIR", "tile_archives")
+TILE_ARCHIVE_MAXZOOM = int(os.environ.get("TILE_ARCHIVE_MAXZOOM", 14))
+TILE_ARCHIVE_MMAP_SIZE = int(os.environ.get("TILE_ARCHIVE_MMAP_SIZE", 256 * 1024 * 1024))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tiles (
+    zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB,
+    PRIMARY KEY (zoom_level, tile_column, tile_row)
+);
+"""
+
+
+class MBTiles:
+    """
+    A minimal MBTiles (https://github.com/mapbox/mbtiles-spec) archive of MVT tiles.
+
+    Tiles are addressed in XYZ like everywhere else in this app, the flip to the TMS row
+    order used by MBTiles happens in here. As the spec demands, tile data is stored gzipped.
+    """
+
+    def __init__(self, path: str, mmap_size: int = TILE_ARCHIVE_MMAP_SIZE):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        # read tiles straight from the page cache instead of copying them through read() calls
+        self.db.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+
+    @staticmethod
+    def _row(z: int, y: int) -> int:
+        return (1 << z) - 1 - y
+
+    def get(self, z: int, x: int, y: int) -> Optional[bytes]:
+        row = self.db.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, self._row(z, y)),
+        ).fetchone()
+
+        return gzip.decompress(row[0]) if row else None
+
+    def has(self, z: int, x: int, y: int) -> bool:
+        return self.db.execute(
+            "SELECT 1 FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, self._row(z, y)),
+        ).fetchone() is not None
+
+    def put(self, z: int, x: int, y: int, content: bytes, commit: bool = True):
+        self.db.execute(
+            "INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)",
+            (z, x, self._row(z, y), gzip.compress(content)),
+        )
+        if commit:
+            self.db.commit()
+
+    def set_metadata(self, name: str, minzoom: int, maxzoom: int, bounds: tuple, layers: Sequence[Layer]):
+        vector_layers = [
+            {
+                "id": layer.mvt_name,
+                "fields": {
+                    **{a: "Number" if a == layer.id_column else "String" for a in layer.attributes},
+                    **({layer.id_column: "Number", "point_count": "Number"} if layer.cluster else {}),
+                },
+                "minzoom": layer.minzoom,
+                "maxzoom": layer.maxzoom,
+            }
+            for layer in layers
+        ]
+        metadata = {
+            "name": name,
+            "format": "pbf",
+            "minzoom": str(minzoom),
+            "maxzoom": str(maxzoom),
+            "bounds": ",".join(str(b) for b in bounds),
+            "json": json.dumps({"vector_layers": vector_layers}),
+        }
+        self.db.executemany("INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)", metadata.items())
+        self.db.commit()
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+class TileArchive:
+    """
+    Read-through MBTiles archives, one per combination of layers and postal code, for the
+    zoom levels up to `maxzoom`.
+
+    The archives are built offline with `seed.py --mbtiles`, tiles missing from them are
+    written back once they've been rendered live.
+    """
+
+    def __init__(self, directory: str = TILE_ARCHIVE_DIR, maxzoom: int = TILE_ARCHIVE_MAXZOOM):
+        self.directory = Path(directory)
+        self.maxzoom = maxzoom
+
+        self._archives: Dict[Tuple[str, str], MBTiles] = {}
+        # the sqlite connections are shared by the threadpool's threads
+        self._lock = threading.Lock()
+
+    def covers(self, tile: Tile) -> bool:
+        return tile.z <= self.maxzoom
+
+    async def get(self, group: str, layers: Tuple[Layer, ...], tile: Tile) -> Optional[bytes]:
+        return await run_in_threadpool(self._get, group, layers, tile)
+
+    async def put(self, group: str, layers: Tuple[Layer, ...], tile: Tile, content: bytes):
+        await run_in_threadpool(self._put, group, layers, tile, content)
+
+    def _archive(self, group: str, layers: Tuple[Layer, ...]) -> MBTiles:
+        name = ",".join(layer.name for layer in layers)
+        if (archive := self._archives.get((group, name))) is None:
+            path = self.directory / name / f"{group}.mbtiles"
+            if not (exists := path.exists()):
+                path.parent.mkdir(parents=True, exist_ok=True)
+
+            archive = MBTiles(str(path))
+            if not exists:
+                archive.set_metadata(f"{name} {group}", 0, self.maxzoom, (-180, -85.0511, 180, 85.0511), layers)
+            self._archives[group, name] = archive
+
+        return archive
+
+    def _get(self, group: str, layers: Tuple[Layer, ...], tile: Tile) -> Optional[bytes]:
+        with self._lock:
+            return self._archive(group, layers).get(tile.z, tile.x, tile.y)
+
+    def _put(self, group: str, layers: Tuple[Layer, ...], tile: Tile, content: bytes):
+        with self._lock:
+            self._archive(group, layers).put(tile.z, tile.x, tile.y, content)
+
+    def close(self):
+        with self._lock:
+            for archive in self._archives.values():
+                archive.close()
+            self._archives.clear()
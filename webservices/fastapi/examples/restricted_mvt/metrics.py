@@ -0,0 +1,73 @@
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+# in seconds, from cached tiles to slow low zoom levels
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY: List["Histogram"] = []
+
+
+class Histogram:
+    """
+    A Prometheus-style histogram with labels, rendered in the text exposition format.
+
+    Only what this service needs: no client library, no multiprocess support. With several
+    uvicorn workers, each worker exports its own numbers.
+    """
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str], buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+
+        # label values -> (count per bucket, the last one being +Inf, sum)
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        if (series := self._series.get(key)) is None:
+            series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+
+        counts, total = series
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(self._series.items()):
+            labels = ",".join(f'{label}="{value}"' for label, value in zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip((*map(str, self.buckets), "+Inf"), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total[0]}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+
+        return lines
+
+
+def render() -> str:
+    return "\n".join(line for histogram in REGISTRY for line in histogram.render()) + "\n"
+
+
+class Timings:
+    """The durations of the stages of one request, in seconds."""
+
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0.0) + time.perf_counter() - start
+
+    def server_timing(self) -> str:
+        """As the value of a Server-Timing header, in milliseconds."""
+        return ", ".join(f"{name};dur={duration * 1000:.1f}" for name, duration in self.durations.items())
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import asyncpg
+
+from jwtoken import ACCESS_TOKEN_MINUTES
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_MAX_ITEMS = int(os.environ.get("USER_CACHE_MAX_ITEMS", 100000))
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 5 * 60))
+# unknown users are remembered for a shorter time, so new users can log in soon
+USER_CACHE_NEGATIVE_TTL = int(os.environ.get("USER_CACHE_NEGATIVE_TTL", 30))
+
+# see users_notify.sql
+NOTIFY_CHANNEL = "users_plz_changed"
+# a lost listener connection is re-established, waiting this long at first, then twice as long
+# after every failed attempt, up to the maximum
+LISTEN_RECONNECT_DELAY = float(os.environ.get("LISTEN_RECONNECT_DELAY", 1))  # seconds
+LISTEN_RECONNECT_MAX_DELAY = float(os.environ.get("LISTEN_RECONNECT_MAX_DELAY", 60))  # seconds
+
+MISSING = object()
+
+
+class PermissionCache:
+    """
+    Bounded LRU of username -> postal code, where entries expire after a TTL.
+
+    Users without a postal code (or unknown ones) are cached as None, with a shorter TTL.
+    When listening, the users table's trigger notifies about changed users, which are then
+    dropped from the cache right away, instead of after their TTL. If the listening connection
+    is lost, it is re-established, and the cache is cleared once it is back.
+
+    It also remembers when users changed, for as long as access tokens issued before that
+    are valid: these carry the old postal code, see changed_since().
+    """
+
+    def __init__(
+        self,
+        max_items: int = USER_CACHE_MAX_ITEMS,
+        ttl: int = USER_CACHE_TTL,
+        negative_ttl: int = USER_CACHE_NEGATIVE_TTL,
+    ):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        self._entries: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+        # username -> when it last changed, oldest first
+        self._changed: "OrderedDict[str, float]" = OrderedDict()
+        # when everyone last changed, as far as we know: the cache was cleared
+        self._all_changed = 0.0
+        self._listener: Optional[asyncpg.Connection] = None
+        self._dsn: Optional[str] = None
+        self._reconnecting: Optional[asyncio.Task] = None
+        self._closing = False
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.reconnects = 0
+
+    def get(self, username: str):
+        """The cached postal code (which may be None), or MISSING."""
+        if (entry := self._entries.get(username)) is None or entry[1] < time.monotonic():
+            self._entries.pop(username, None)
+            self.misses += 1
+            return MISSING
+
+        self._entries.move_to_end(username)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, username: str, plz: Optional[str]):
+        ttl = self.ttl if plz is not None else self.negative_ttl
+        self._entries[username] = (plz, time.monotonic() + ttl)
+        self._entries.move_to_end(username)
+
+        while len(self._entries) > self.max_items:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, username: Optional[str] = None):
+        """Drop one user, or everyone if no user is given."""
+        self.invalidations += 1
+        now = time.time()
+        if username is None:
+            self._entries.clear()
+            self._all_changed = now
+            self._changed.clear()
+            return
+
+        self._entries.pop(username, None)
+        self._changed[username] = now
+        self._changed.move_to_end(username)
+        while self._changed:
+            oldest, changed = next(iter(self._changed.items()))
+            if changed > now - ACCESS_TOKEN_MINUTES * 60 and len(self._changed) <= self.max_items:
+                break
+            # forgetting a change too early must not let tokens from before it through
+            if changed > now - ACCESS_TOKEN_MINUTES * 60:
+                self._all_changed = max(self._all_changed, changed)
+            del self._changed[oldest]
+
+    def changed_since(self, username: str, issued: float) -> bool:
+        """Whether the user may have changed since a token issued at this (Unix) time."""
+        return issued < max(self._all_changed, self._changed.get(username, 0.0))
+
+    async def listen(self, dsn: str):
+        self._dsn = dsn
+        await self._connect()
+
+    async def close(self):
+        self._closing = True
+        if self._reconnecting is not None:
+            self._reconnecting.cancel()
+        if self._listener is not None and not self._listener.is_closed():
+            await self._listener.close()
+
+    async def _connect(self):
+        # a dedicated connection, a pooled one would be handed out to others while listening
+        listener = await asyncpg.connect(self._dsn)
+        await listener.add_listener(NOTIFY_CHANNEL, self._notified)
+        listener.add_termination_listener(self._terminated)
+        self._listener = listener
+
+    async def _reconnect(self):
+        delay = LISTEN_RECONNECT_DELAY
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self._connect()
+            except Exception as e:
+                delay = min(delay * 2, LISTEN_RECONNECT_MAX_DELAY)
+                logger.warning("Could not reconnect the %s listener (%s), retrying in %ss", NOTIFY_CHANNEL, e, delay)
+                continue
+
+            # users changed while no one was listening are still cached, with their old postal code
+            self.invalidate()
+            self.reconnects += 1
+            logger.info("Reconnected the %s listener", NOTIFY_CHANNEL)
+            return
+
+    def _notified(self, connection, pid, channel, username):
+        self.invalidate(username)
+
+    def _terminated(self, connection):
+        if self._closing:
+            return
+
+        # notifications are lost until reconnected, so nothing cached can be trusted beyond its TTL
+        logger.warning("Lost the %s listener connection, reconnecting", NOTIFY_CHANNEL)
+        self.invalidate()
+        # kept on self, the event loop only holds a weak reference to the task
+        self._reconnecting = asyncio.ensure_future(self._reconnect())
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "reconnects": self.reconnects,
+        }
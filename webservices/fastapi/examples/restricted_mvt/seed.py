@@ -0,0 +1,266 @@
+"""
+Pre-renders tiles of one or more layers for every permitted postal code into the tile cache,
+or into one MBTiles archive per postal code.
+
+    python seed.py --bbox 13.08 52.33 13.76 52.68 --maxzoom 16
+    python seed.py --geojson bezirke.geojson --maxzoom 14 --plz 10365 --mbtiles tile_archives/
+    python seed.py --geojson bezirke.geojson --maxzoom 14 --layers adresses,bezirke
+
+Seeding is resumable: tiles already in the target are not rendered again, and neither are
+tiles recorded as empty. As the children of a tile that is empty for a postal code are empty
+as well, they are skipped altogether, from the zoom level on where all seeded layers show up.
+
+Tiles seeded into the tile cache expire after --ttl seconds, 30 days by default, instead of
+the server's TILE_CACHE_TTL.
+"""
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from buildpg import asyncpg
+from fastapi import HTTPException
+
+from cache import TileCache
+from engine import DATABASE_URL
+from mbtiles import MBTiles
+from layers import LAYERS, inspect_layers, parse_layers, permission_group
+from tiles import fetch_tile, tms
+
+
+def geojson_bounds(path: str) -> tuple:
+    with open(path) as f:
+        data = json.load(f)
+
+    xs, ys = [], []
+
+    def walk(coords):
+        if isinstance(coords[0], (int, float)):
+            xs.append(coords[0])
+            ys.append(coords[1])
+        else:
+            for c in coords:
+                walk(c)
+
+    for feature in data.get("features", [data]):
+        walk(feature.get("geometry", feature)["coordinates"])
+
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+SEED_TTL = 30 * 24 * 60 * 60
+
+
+class CacheTarget:
+    def __init__(self, layers: tuple, ttl: int = SEED_TTL):
+        self.layers = ",".join(layer.name for layer in layers)
+        # the seeder only fills the on-disk level, there's no point in keeping tiles in memory;
+        # the server reads the expiry of each tile off its file, so seeded tiles keep this ttl
+        self.cache = TileCache(max_items=0, ttl=ttl)
+
+    async def seeded(self, group, tile) -> Optional[bool]:
+        """None if the tile wasn't seeded yet, else whether it has any content."""
+        if (cached := await self.cache.get((group, self.layers, tile.z, tile.x, tile.y))) is None:
+            return None
+        return bool(cached.content)
+
+    async def put(self, group, tile, content: bytes):
+        # empty tiles are cached as well, just like the server does when it renders them
+        await self.cache.set((group, self.layers, tile.z, tile.x, tile.y), content)
+
+    def close(self):
+        pass
+
+
+class MBTilesTarget:
+    commit_every = 500
+
+    # tiles seeded empty, which MBTiles doesn't store, so seeding can resume past them
+    EMPTY_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS seeded_empty (z INTEGER, x INTEGER, y INTEGER, PRIMARY KEY (z, x, y));
+    """
+
+    def __init__(self, directory: str, layers: tuple, bounds: tuple, minzoom: int, maxzoom: int):
+        self.layers = layers
+        self.name = ",".join(layer.name for layer in layers)
+        # the same layout as mbtiles.TileArchive, so it can serve the archives
+        self.directory = Path(directory) / self.name
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.bounds = bounds
+        self.minzoom = minzoom
+        self.maxzoom = maxzoom
+
+        self.archives = {}
+        self.pending = 0
+        # sqlite blocks, so all archive access runs in this one thread instead of the event loop
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def _archive(self, group) -> MBTiles:
+        if group not in self.archives:
+            archive = MBTiles(str(self.directory / f"{group}.mbtiles"))
+            archive.db.executescript(self.EMPTY_SCHEMA)
+            archive.set_metadata(f"{self.name} {group}", self.minzoom, self.maxzoom, self.bounds, self.layers)
+            self.archives[group] = archive
+
+        return self.archives[group]
+
+    def _seeded(self, group, tile) -> Optional[bool]:
+        archive = self._archive(group)
+        if archive.has(tile.z, tile.x, tile.y):
+            return True
+        if archive.db.execute(
+            "SELECT 1 FROM seeded_empty WHERE z = ? AND x = ? AND y = ?",
+            (tile.z, tile.x, tile.y),
+        ).fetchone() is not None:
+            return False
+        return None
+
+    def _put(self, group, tile, content: bytes):
+        archive = self._archive(group)
+        if content:
+            archive.put(tile.z, tile.x, tile.y, content, commit=False)
+        else:
+            archive.db.execute(
+                "INSERT OR REPLACE INTO seeded_empty (z, x, y) VALUES (?, ?, ?)",
+                (tile.z, tile.x, tile.y),
+            )
+
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            for archive in self.archives.values():
+                archive.commit()
+            self.pending = 0
+
+    def _close(self):
+        for archive in self.archives.values():
+            archive.close()
+
+    async def seeded(self, group, tile) -> Optional[bool]:
+        """None if the tile wasn't seeded yet, else whether it has any content."""
+        return await self._run(self._seeded, group, tile)
+
+    async def put(self, group, tile, content: bytes):
+        await self._run(self._put, group, tile, content)
+
+    def close(self):
+        self.executor.submit(self._close).result()
+        self.executor.shutdown()
+
+
+class Progress:
+    def __init__(self, interval: float = 5):
+        self.interval = interval
+        self.start = self.last = time.perf_counter()
+        self.rendered = self.empty = self.skipped = 0
+
+    def tick(self):
+        if (now := time.perf_counter()) - self.last >= self.interval:
+            self.last = now
+            self.report()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.start
+        print(
+            f"{self.rendered} rendered, {self.empty} empty, {self.skipped} already seeded "
+            f"in {elapsed:.1f}s ({self.rendered / elapsed:.1f} tiles/s)"
+        )
+
+
+async def seed(pool, target, layers, plzs, bounds, minzoom, maxzoom, concurrency):
+    progress = Progress()
+    # public layers look the same for every postal code, these are only rendered once
+    groups = list(dict.fromkeys(permission_group(layers, plz) for plz in plzs))
+
+    async def render(group, tile, non_empty):
+        if (seeded := await target.seeded(group, tile)) is not None:
+            progress.skipped += 1
+            has_content = seeded
+        else:
+            async with pool.acquire() as conn:
+                content = await fetch_tile(conn, tile, layers, group)
+
+            # empty tiles are recorded too, so a resumed run skips them and their children
+            await target.put(group, tile, content)
+            has_content = bool(content)
+            if has_content:
+                progress.rendered += 1
+            else:
+                progress.empty += 1
+
+        if not has_content:
+            progress.tick()
+            return
+
+        non_empty[group].add(tile)
+        progress.tick()
+
+    # below the minzoom of a layer, an empty tile says nothing about its children
+    prune_from = max(layer.minzoom for layer in layers)
+
+    parents = None  # per postal code, the tiles of the previous zoom level which had data
+    for z in range(minzoom, maxzoom + 1):
+        non_empty = {group: set() for group in groups}
+        jobs = iter(
+            (group, tile)
+            for tile in tms.tiles(*bounds, [z])
+            for group in groups
+            if parents is None or z - 1 < prune_from or tms.parent(tile)[0] in parents[group]
+        )
+
+        # as many workers as the pool has connections, all sharing one job iterator
+        async def worker():
+            for group, tile in jobs:
+                await render(group, tile, non_empty)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        parents = non_empty
+
+    progress.report()
+
+
+async def main(args):
+    bounds = tuple(args.bbox) if args.bbox else geojson_bounds(args.geojson)
+
+    pool = await asyncpg.create_pool_b(args.dsn, min_size=args.concurrency, max_size=args.concurrency)
+    async with pool.acquire() as conn:
+        try:
+            layers = parse_layers(args.layers, await inspect_layers(conn))
+        except HTTPException as e:
+            raise SystemExit(e.detail)
+    plzs = args.plz or [
+        r["plz"] for r in await pool.fetch("SELECT DISTINCT plz FROM users WHERE plz IS NOT NULL")
+    ]
+
+    if args.mbtiles:
+        target = MBTilesTarget(args.mbtiles, layers, bounds, args.minzoom, args.maxzoom)
+    else:
+        target = CacheTarget(layers, args.ttl)
+
+    try:
+        await seed(pool, target, layers, plzs, bounds, args.minzoom, args.maxzoom, args.concurrency)
+    finally:
+        target.close()
+        await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    area = parser.add_mutually_exclusive_group(required=True)
+    area.add_argument("--bbox", type=float, nargs=4, metavar=("WEST", "SOUTH", "EAST", "NORTH"))
+    area.add_argument("--geojson", help="seed the bounding box of this GeoJSON file")
+    parser.add_argument("--minzoom", type=int, default=0)
+    parser.add_argument("--maxzoom", type=int, required=True)
+    parser.add_argument("--plz", action="append", help="postal code to seed, repeatable (default: all users' postal codes)")
+    parser.add_argument("--layers", default="adresses", help=f"comma separated, out of {', '.join(LAYERS)}")
+    parser.add_argument("--mbtiles", metavar="DIR", help="write <DIR>/<layers>/<plz>.mbtiles archives instead of the tile cache")
+    parser.add_argument("--ttl", type=int, default=SEED_TTL, help="seconds until tiles seeded into the tile cache expire (default: 30 days)")
+    parser.add_argument("--concurrency", type=int, default=10, help="number of pool connections rendering in parallel")
+    parser.add_argument("--dsn", default=DATABASE_URL)
+
+    asyncio.run(main(parser.parse_args()))
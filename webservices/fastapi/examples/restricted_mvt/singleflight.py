@@ -0,0 +1,43 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into a single execution.
+
+    The first caller for a key runs the coroutine, every caller arriving while it is
+    still running waits for (and receives) that same result.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, asyncio.Future] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if (flight := self._flights.get(key)) is not None:
+            self.coalesced += 1
+        else:
+            self.executed += 1
+            flight = asyncio.ensure_future(fn())
+            self._flights[key] = flight
+            flight.add_done_callback(lambda f: self._land(key, f))
+
+        # shielded, so a disconnecting client doesn't cancel the query for everyone else
+        return await asyncio.shield(flight)
+
+    def _land(self, key: Hashable, flight: asyncio.Future):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+        # mark the exception as retrieved, in case every waiter went away
+        if not flight.cancelled():
+            flight.exception()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "executed": self.executed,
+            "coalesced": self.coalesced,  # queries saved
+        }
@@ -0,0 +1,185 @@
+import os
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+
+import morecantile
+from morecantile import Tile
+
+from layers import Layer
+
+tms = morecantile.tms.get("WebMercatorQuad")
+
+
+class ZoomConfig(NamedTuple):
+    extent: int = 4096  # tile coordinate space of ST_AsMVTGeom/ST_AsMVT
+    buffer: int = 256  # in tile coordinates, too
+    cluster: Optional[float] = None  # if set, keep one point per cell of this many tile units
+    max_features: int = 50000  # per layer, features beyond this are dropped, deterministically
+
+
+# below this zoom level, points are clustered on a grid instead of being sent one by one
+GENERALIZE_BELOW_ZOOM = int(os.environ.get("TILE_GENERALIZE_BELOW_ZOOM", 14))
+
+DETAILED = ZoomConfig()
+GENERALIZED = ZoomConfig(extent=1024, buffer=16, cluster=4, max_features=10000)
+
+# per zoom level overrides, e.g. {10: ZoomConfig(extent=512, buffer=8, cluster=8)}
+ZOOM_CONFIGS: Dict[int, ZoomConfig] = {}
+
+
+def zoom_config(z: int) -> ZoomConfig:
+    if z in ZOOM_CONFIGS:
+        return ZOOM_CONFIGS[z]
+
+    return GENERALIZED if z < GENERALIZE_BELOW_ZOOM else DETAILED
+
+
+# A layer with more than max_features features in a tile is sampled: its features are ordered
+# by a hash of their id before the cut, which samples them evenly but always picks the same
+# ones. Only such tiles pay for hashing and sorting: a probe counts up to max_features + 1
+# features first, and of the two branches below only the one it selects is run (both
+# conditions are constant for the query, Postgres checks them once, before the scans).
+LAYER_QUERY = """
+WITH sampled AS (
+    SELECT count(*) > {max_features} AS sampled FROM (
+        SELECT 1
+            FROM {table} t,
+                 (SELECT ST_MakeEnvelope($1, $2, $3, $4, $5) AS geom) bounds
+            WHERE {where}
+            LIMIT {max_features} + 1
+         ) probe
+)
+SELECT ST_AsMVT(tile.*, '{name}', {extent}, 'geom') FROM (
+    SELECT ST_AsMVTGeom({geom}, bounds.geom, {extent}, {buffer}) AS geom{attributes}
+        FROM {table} t,
+             (SELECT ST_MakeEnvelope($1, $2, $3, $4, $5) AS geom) bounds
+        WHERE {where} AND NOT (SELECT sampled FROM sampled)
+    UNION ALL
+    (SELECT ST_AsMVTGeom({geom}, bounds.geom, {extent}, {buffer}) AS geom{attributes}
+        FROM {table} t,
+             (SELECT ST_MakeEnvelope($1, $2, $3, $4, $5) AS geom) bounds
+        WHERE {where} AND (SELECT sampled FROM sampled)
+        ORDER BY md5(t.{id}::text)
+        LIMIT {max_features})
+     ) tile
+"""
+
+# Same as above, but the points are snapped to a grid of {cluster} tile units, and every grid
+# cell only keeps its point with the lowest id, along with the number of points it stands for.
+# The cells are counted once they exist, only more than max_features of them are sampled.
+CLUSTERED_LAYER_QUERY = """
+WITH cells AS (
+    SELECT ST_SnapToGrid(mvtgeom.geom, {cluster}) AS geom, min(mvtgeom.id) AS {id}, count(*) AS point_count
+        FROM (
+            SELECT ST_AsMVTGeom({geom}, bounds.geom, {extent}, {buffer}) AS geom, t.{id} AS id
+                FROM {table} t,
+                     (SELECT ST_MakeEnvelope($1, $2, $3, $4, $5) AS geom) bounds
+                WHERE {where}
+             ) mvtgeom
+        WHERE mvtgeom.geom IS NOT NULL
+        GROUP BY ST_SnapToGrid(mvtgeom.geom, {cluster})
+)
+SELECT ST_AsMVT(tile.*, '{name}', {extent}, 'geom') FROM (
+    SELECT * FROM cells WHERE (SELECT count(*) FROM cells) <= {max_features}
+    UNION ALL
+    (SELECT * FROM cells
+        WHERE (SELECT count(*) FROM cells) > {max_features}
+        ORDER BY md5(cells.{id}::text)
+        LIMIT {max_features})
+     ) tile
+"""
+
+
+def layer_query(layer: Layer, config: ZoomConfig, param) -> str:
+    if layer.mercator:
+        geom = f"t.{layer.mercator_column}"
+        where = f"ST_Intersects(t.{layer.mercator_column}, bounds.geom)"
+    else:
+        geom = f"ST_Transform(t.{layer.geometry_column}, 3857)"
+        where = f"ST_Intersects(t.{layer.geometry_column}, ST_Transform(bounds.geom, 4326))"
+
+    if layer.permission_column:
+        where = f"t.{layer.permission_column} = {param('plz')} AND {where}"
+
+    clustered = layer.cluster and config.cluster is not None
+    # only parameters the query actually uses may be registered, Postgres can't type the others
+    return (CLUSTERED_LAYER_QUERY if clustered else LAYER_QUERY).format(
+        name=layer.mvt_name,
+        table=layer.table,
+        id=layer.id_column,
+        attributes="".join(f", t.{a}" for a in layer.attributes),
+        geom=geom,
+        where=where,
+        extent=param("extent"),
+        buffer=param("buffer"),
+        max_features=param("max_features"),
+        cluster=param("cluster") if clustered else None,
+    )
+
+
+@lru_cache(maxsize=256)
+def build_query(layers: Tuple[Layer, ...], config: ZoomConfig) -> Tuple[str, Tuple[str, ...]]:
+    """
+    The query rendering a tile of the given layers, and the names of its bind parameters.
+
+    The query text only depends on the layers and the zoom level's config: the postal code is
+    a bind parameter like the tile bounds. asyncpg prepares each distinct query once per
+    connection and keeps it in its statement cache, so Postgres parses and plans each query
+    only once per connection.
+
+    Several layers are rendered in one round trip: an MVT is a list of layers, so the
+    individual layers' ST_AsMVT outputs are simply concatenated.
+    """
+    params = ["xmin", "ymin", "xmax", "ymax", "epsg"]
+
+    def param(name):
+        if name not in params:
+            params.append(name)
+        return f"${params.index(name) + 1}"
+
+    parts = [f"COALESCE(({layer_query(layer, config, param)}), ''::bytea)" for layer in layers]
+
+    return "SELECT " + "\n    || ".join(parts), tuple(params)
+
+
+def tile_query(tile: Tile, layers: Sequence[Layer], plz: str) -> Optional[tuple]:
+    """The query and its arguments to render one tile, None if no layer is visible at its zoom."""
+    if not (layers := tuple(layer for layer in layers if layer.minzoom <= tile.z <= layer.maxzoom)):
+        return None
+
+    config = zoom_config(tile.z)
+    query, params = build_query(layers, config)
+
+    bbox = tms.xy_bounds(tile)
+    values = {
+        "xmin": bbox.left,
+        "ymin": bbox.bottom,
+        "xmax": bbox.right,
+        "ymax": bbox.top,
+        "epsg": tms.crs.to_epsg(),
+        "plz": plz,
+        "extent": config.extent,
+        "buffer": config.buffer,
+        "max_features": config.max_features,
+        "cluster": float(config.cluster or 0),
+    }
+
+    return query, tuple(values[p] for p in params)
+
+
+async def fetch_tile(conn, tile: Tile, layers: Sequence[Layer], plz: str) -> bytes:
+    """Render one tile of the given layers for one postal code as MVT."""
+    if (prepared := tile_query(tile, layers, plz)) is None:
+        return b""
+
+    query, args = prepared
+    return bytes(await conn.fetchval(query, *args))
+
+
+async def explain_tile(conn, tile: Tile, layers: Sequence[Layer], plz: str) -> Optional[str]:
+    """The query plan of a tile's query, without running it again."""
+    if (prepared := tile_query(tile, layers, plz)) is None:
+        return None
+
+    query, args = prepared
+    return "\n".join(r[0] for r in await conn.fetch(f"EXPLAIN {query}", *args))
@@ -0,0 +1,21 @@
+-- Notifies the tile service about users whose postal code changed (or who were added or
+-- removed), so it can drop them from its permission cache right away.
+--
+--   psql -d gis -f users_notify.sql
+
+CREATE OR REPLACE FUNCTION notify_users_plz_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM pg_notify('users_plz_changed', OLD.username);
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.username IS DISTINCT FROM OLD.username) THEN
+        PERFORM pg_notify('users_plz_changed', NEW.username);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_plz_changed ON users;
+CREATE TRIGGER users_plz_changed
+    AFTER INSERT OR UPDATE OF plz, username OR DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION notify_users_plz_changed();
@@ -2,19 +2,30 @@
 """
 Example RESTful API Server.
 """
+import os
+
 from flask import Flask
 
 
-def create_app(**kwargs):
+def create_app(flask_config_name=None, **kwargs):
     """
     Entry point to the Flask RESTful Server application.
+
+    The config is picked by name, see config.CONFIG_NAME_MAPPER: from the argument, or else
+    from the FLASK_CONFIG environment variable, defaulting to 'development'.
     """
+    from config import CONFIG_NAME_MAPPER
 
     # Initialize the Flas-App
     app: Flask = Flask(__name__, **kwargs)
 
     # Load the config file
-    app.config.from_object('config.DevelopmentConfig')
+    flask_config_name = flask_config_name or os.environ.get('FLASK_CONFIG', 'development')
+    try:
+        app.config.from_object(CONFIG_NAME_MAPPER[flask_config_name])
+    except KeyError:
+        raise ValueError("Unknown FLASK_CONFIG {!r}, use one of {}.".format(
+            flask_config_name, ', '.join(CONFIG_NAME_MAPPER)))
 
     # Initialize the API extensions
     from . import extensions
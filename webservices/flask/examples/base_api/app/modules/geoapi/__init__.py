@@ -13,6 +13,7 @@ def init_app(app, **kwargs):
     Init GeoAPI module.
     """
     # Touch underlying modules
-    from . import resources
+    from . import payloads, resources
 
     api_v1.add_namespace(resources.api)
+    api_v1.representation('application/json')(payloads.output_json)
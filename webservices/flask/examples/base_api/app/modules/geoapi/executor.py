@@ -0,0 +1,135 @@
+# encoding: utf-8
+"""
+GeoAPI executor
+---------------
+
+Runs geometry computations either right in the request thread, or, for geometries with many
+vertices, in a pool of worker processes. Large geometries then don't hold the GIL of the
+process serving requests, and small requests next to them stay fast.
+
+Computations in the pool are limited in CPU time, see GEOAPI_CPU_TIMEOUT in config.py. The
+limit interrupts Python code: a single call into numpy or pyproj runs to its end first, which
+GEOAPI_MAX_VERTICES keeps short.
+"""
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+
+from flask import current_app
+
+
+class GeometryRejected(Exception):
+    """A geometry the API refuses to compute, with the HTTP status to answer with."""
+    code = HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+class GeometryTooLarge(GeometryRejected):
+    code = HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+
+
+class GeometryTimeout(GeometryRejected):
+    """The computation ran out of CPU time: the geometry may be fine, the server was too busy."""
+    code = HTTPStatus.SERVICE_UNAVAILABLE
+
+
+class GeometryWaitTimeout(GeometryTimeout):
+    code = HTTPStatus.GATEWAY_TIMEOUT
+
+
+class _CpuTimeExceeded(BaseException):
+    # not an Exception: computations catching those (e.g. per feature) must not swallow it
+    pass
+
+
+def _raise_cpu_time_exceeded(signum, frame):
+    raise _CpuTimeExceeded()
+
+
+def _init_worker():
+    # runs once in every pool process
+    signal.signal(signal.SIGPROF, _raise_cpu_time_exceeded)
+
+
+def _with_cpu_limit(seconds, fn, args):
+    # ITIMER_PROF counts the CPU time this process spends, not the time it waits
+    signal.setitimer(signal.ITIMER_PROF, seconds)
+    try:
+        return fn(*args)
+    except _CpuTimeExceeded:
+        raise GeometryTimeout('The geometry took longer than {} s of CPU time to process.'.format(seconds))
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool, _pool_pid
+
+    with _pool_lock:
+        # a pool inherited from the process this one was forked from (e.g. gunicorn's master
+        # with preload_app) is not usable here
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(
+                max_workers=current_app.config['GEOAPI_PROCESSES'],
+                # fresh interpreters, forking a multi-threaded server process is not safe
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+            _pool_pid = os.getpid()
+
+        return _pool
+
+
+def _reset_pool(broken):
+    global _pool
+
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+
+
+def check_vertices(vertices):
+    """
+    Raises GeometryTooLarge beyond GEOAPI_MAX_VERTICES.
+    """
+    max_vertices = current_app.config['GEOAPI_MAX_VERTICES']
+    if vertices > max_vertices:
+        raise GeometryTooLarge('The geometry has {} vertices, at most {} are allowed.'.format(vertices, max_vertices))
+
+
+def compute(fn, *args, vertices):
+    """
+    fn(*args), in the request thread if `vertices` is below GEOAPI_OFFLOAD_VERTICES, else in the
+    process pool. fn and args have to be picklable, i.e. module-level functions and plain data.
+
+    Raises GeometryTooLarge beyond GEOAPI_MAX_VERTICES, GeometryTimeout if the computation took
+    more than GEOAPI_CPU_TIMEOUT seconds of CPU time, and GeometryWaitTimeout if it took more
+    than GEOAPI_WAIT_TIMEOUT in total.
+    """
+    check_vertices(vertices)
+
+    config = current_app.config
+
+    if vertices < config['GEOAPI_OFFLOAD_VERTICES']:
+        return fn(*args)
+
+    pool = _get_pool()
+    try:
+        future = pool.submit(_with_cpu_limit, config['GEOAPI_CPU_TIMEOUT'], fn, args)
+        return future.result(timeout=config['GEOAPI_WAIT_TIMEOUT'])
+    except FutureTimeoutError:
+        # still queued, it is dropped; once running, it can't be stopped from here, its CPU limit will end it
+        future.cancel()
+        raise GeometryWaitTimeout('The geometry took longer than {} s to process.'.format(config['GEOAPI_WAIT_TIMEOUT']))
+    except BrokenProcessPool:
+        # a pool process died, e.g. killed for running out of memory; the next request gets a new pool
+        _reset_pool(pool)
+        raise
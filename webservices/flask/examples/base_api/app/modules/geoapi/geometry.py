@@ -0,0 +1,210 @@
+# encoding: utf-8
+"""
+GeoAPI geometry computations
+----------------------------
+
+Plain functions on GeoJSON coordinates, free of any request handling.
+"""
+import threading
+from functools import lru_cache
+
+import numpy as np
+import pyproj
+
+WGS84 = 'epsg:4326'
+
+# Polygons are projected to a Lambert azimuthal equal-area projection centred on them, valid
+# anywhere on earth. Centres are rounded to this many degrees, so polygons of the same region
+# share their projection: its distortion only grows slowly with the distance to the centre.
+EQUAL_AREA_CENTRE_DEGREES = 1.0
+# the number of projections kept per thread, one per region
+EQUAL_AREA_CACHE_SIZE = 512
+
+# pyproj objects (before pyproj 3.1) must not be used by several threads at once, so every
+# thread serving requests builds and keeps its own
+_local = threading.local()
+
+
+def equal_area_transformer(lng_0, lat_0):
+    """
+    The transformer from WGS84 to the equal-area projection centred at lng_0, lat_0.
+
+    Building a transformer is far more expensive than using it, so it's built once per centre
+    and thread. always_xy: GeoJSON coordinates are [lng, lat], whatever the CRS' axis order.
+    """
+    try:
+        transformers = _local.equal_area_transformers
+    except AttributeError:
+        transformers = _local.equal_area_transformers = lru_cache(maxsize=EQUAL_AREA_CACHE_SIZE)(_equal_area_transformer)
+
+    return transformers(lng_0, lat_0)
+
+
+def _equal_area_transformer(lng_0, lat_0):
+    return pyproj.Transformer.from_crs(
+        WGS84,
+        '+proj=laea +lat_0={} +lon_0={} +x_0=0 +y_0=0 +datum=WGS84 +units=m +no_defs'.format(lat_0, lng_0),
+        always_xy=True,
+    )
+
+
+def equal_area_centre(exterior):
+    """
+    The centre of the projection for a polygon: its bounding box' centre, rounded.
+
+    The longitudes are unwrapped around the first vertex first: a polygon crossing the
+    antimeridian, e.g. from 179° to -179°, is centred on 180°, not on the other side of the earth.
+    """
+    lng, lat = exterior[:, 0], exterior[:, 1]
+    lng = (lng - lng[0] + 180) % 360 - 180 + lng[0]
+
+    def rounded(value):
+        return float(round(value / EQUAL_AREA_CENTRE_DEGREES) * EQUAL_AREA_CENTRE_DEGREES)
+
+    lng_0 = (rounded((lng.min() + lng.max()) / 2) + 180) % 360 - 180
+    return lng_0, min(max(rounded((lat.min() + lat.max()) / 2), -90.0), 90.0)
+
+
+def polygon_rings(coordinates):
+    """
+    The rings of a GeoJSON polygon, as (n, 2) arrays, exterior first.
+
+    Accepts the rings of a GeoJSON Polygon, or its exterior ring only. Rings are closed if
+    they aren't already.
+    """
+    if isinstance(coordinates[0][0], (int, float)):
+        coordinates = [coordinates]
+
+    rings = []
+    for ring in coordinates:
+        ring = np.asarray(ring, dtype=float)[:, :2]
+        if not np.array_equal(ring[0], ring[-1]):
+            ring = np.vstack([ring, ring[:1]])
+        if len(ring) < 4:
+            raise ValueError('A polygon ring needs at least 3 distinct positions.')
+        rings.append(ring)
+
+    return rings
+
+
+def _shoelace(x, y):
+    # relative to the first vertex, projected coordinates are too large for exact products
+    x, y = x - x[0], y - y[0]
+    return float(abs(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1])) / 2)
+
+
+def _projected_areas(transformer, polygons):
+    # all polygons' vertices are projected in one go, then every ring's area is computed from
+    # its slice of the projected coordinates
+    rings = [ring for rings in polygons for ring in rings]
+    lng, lat = np.concatenate(rings).T
+    x, y = transformer.transform(lng, lat)
+
+    ends = np.cumsum([len(ring) for ring in rings])
+    ring_areas = iter([_shoelace(x[end - len(ring):end], y[end - len(ring):end]) for ring, end in zip(rings, ends)])
+
+    # the holes are cut out of the exterior ring
+    areas = []
+    for rings in polygons:
+        exterior = next(ring_areas)
+        areas.append(exterior - sum(next(ring_areas) for _ in rings[1:]))
+
+    return areas
+
+
+def polygon_areas(polygons):
+    """
+    The areas of GeoJSON polygons in m², each in an equal-area projection centred on it.
+
+    Polygons sharing a projection are projected together.
+    """
+    polygons = [polygon_rings(coordinates) for coordinates in polygons]
+
+    # projection centre -> indices of its polygons
+    regions = {}
+    for i, rings in enumerate(polygons):
+        regions.setdefault(equal_area_centre(rings[0]), []).append(i)
+
+    areas = [0.0] * len(polygons)
+    for centre, indices in regions.items():
+        for i, area in zip(indices, _projected_areas(equal_area_transformer(*centre), [polygons[i] for i in indices])):
+            areas[i] = area
+
+    return areas
+
+
+def polygon_area(coordinates):
+    """
+    The area of a GeoJSON polygon in m², see polygon_areas().
+    """
+    return polygon_areas([coordinates])[0]
+
+
+def wgs84_geod():
+    """
+    Geodesics on the WGS84 ellipsoid (Karney's algorithm), as geopy's geodesic distance, one
+    per thread like equal_area_transformer().
+    """
+    try:
+        return _local.geod
+    except AttributeError:
+        _local.geod = pyproj.Geod(ellps='WGS84')
+        return _local.geod
+
+
+def positions(coordinates):
+    """
+    GeoJSON positions as an (n, 2) array of [lng, lat].
+    """
+    array = np.asarray(coordinates, dtype=float)
+    if array.size == 0:
+        return np.empty((0, 2))
+
+    return array[:, :2]
+
+
+def line_lengths(lines):
+    """
+    The geodesic lengths of GeoJSON linestrings in meters.
+
+    The vertices of all lines are concatenated and all segments are measured in one go, the
+    ones joining one line's end to the next line's start simply aren't summed up.
+    """
+    lines = [positions(coordinates) for coordinates in lines]
+    lengths = [0.0] * len(lines)
+    measured = [i for i, line in enumerate(lines) if len(line) > 1]
+    if not measured:
+        return lengths
+
+    lng, lat = np.concatenate([lines[i] for i in measured]).T
+    _, _, segments = wgs84_geod().inv(lng[:-1], lat[:-1], lng[1:], lat[1:])
+    # the distance from the first vertex up to every vertex
+    along = np.concatenate([[0.0], np.cumsum(segments)])
+
+    ends = np.cumsum([len(lines[i]) for i in measured])
+    for i, end in zip(measured, ends):
+        lengths[i] = float(along[end - 1] - along[end - len(lines[i])])
+
+    return lengths
+
+
+def line_length(coordinates):
+    """
+    The geodesic length of a GeoJSON linestring in meters, see line_lengths().
+    """
+    return line_lengths([coordinates])[0]
+
+
+def distance_matrix(origins, destinations):
+    """
+    The geodesic distances in kilometers from every origin (rows) to every destination (columns).
+    """
+    origins, destinations = positions(origins), positions(destinations)
+
+    # every origin repeated for every destination, all measured in one go
+    lng1, lat1 = np.repeat(origins, len(destinations), axis=0).T
+    lng2, lat2 = np.tile(destinations, (len(origins), 1)).T
+    _, _, meters = wgs84_geod().inv(lng1, lat1, lng2, lat2)
+
+    return (np.asarray(meters) / 1000).reshape(len(origins), len(destinations)).tolist()
+
@@ -0,0 +1,219 @@
+# encoding: utf-8
+"""
+GeoAPI result memoization
+-------------------------
+
+Results of geometry computations, keyed by a hash of the operation and its canonicalized
+input: the same polygon sent twice is computed once. Results are kept in an in-process LRU,
+and optionally in a directory shared by all processes (GEOAPI_CACHE_DIR in config.py).
+"""
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+from flask import current_app
+
+from app.modules.geoapi.executor import check_vertices, compute
+from app.modules.geoapi.payloads import dumps, loads
+
+# the shared directory is pruned every this many writes of a process
+_PRUNE_EVERY = 1000
+
+
+def _is_positions(value):
+    return bool(isinstance(value, (list, tuple)) and value and isinstance(value[0], (list, tuple)) and value[0] and
+                isinstance(value[0][0], (int, float)))
+
+
+def _update(hasher, value):
+    if isinstance(value, np.ndarray) or _is_positions(value):
+        try:
+            # all positions at once, as float64: [1, 2] and [1.0, 2.0] are the same position
+            array = np.asarray(value, dtype=float)
+        except ValueError:
+            # positions of mixed dimensions, hashed one by one
+            array = None
+        if array is not None and array.ndim == 2:
+            hasher.update(b'P%d:%d,' % array.shape[:2])
+            hasher.update(array.tobytes())
+            return
+
+    if isinstance(value, (list, tuple, np.ndarray)):
+        hasher.update(b'L%d,' % len(value))
+        for item in value:
+            _update(hasher, item)
+    else:
+        hasher.update(repr(value).encode())
+        hasher.update(b',')
+
+
+def result_key(fn, *args):
+    """
+    The cache key of fn(*args), a hash of the function's name and the arguments' contents.
+    """
+    hasher = hashlib.blake2b(digest_size=20)
+    hasher.update('{}.{}('.format(fn.__module__, fn.__name__).encode())
+    for arg in args:
+        _update(hasher, arg)
+
+    return hasher.hexdigest()
+
+
+class ResultCache(object):
+    """
+    An LRU of JSON serializable results bounded by their serialized size, optionally in front
+    of a directory of result files bounded by their total size.
+    """
+
+    def __init__(self, max_bytes, directory=None, directory_max_bytes=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.directory_max_bytes = directory_max_bytes
+
+        self._results = OrderedDict()  # key -> (result, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """(True, result) if cached, else (False, None)."""
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return True, self._results[key][0]
+
+        if self.directory:
+            try:
+                with open(self._path(key)) as f:
+                    content = f.read()
+                result = loads(content)
+            except (OSError, ValueError):
+                # missing, or e.g. cut short by a full disk: computed again, and overwritten
+                pass
+            else:
+                with self._lock:
+                    self.disk_hits += 1
+                self._remember(key, result, len(content))
+                return True, result
+
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def set(self, key, result):
+        content = dumps(result)
+        self._remember(key, result, len(content))
+
+        if self.directory:
+            self._write(key, content)
+
+    def _remember(self, key, result, size):
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._results:
+                self._bytes -= self._results.pop(key)[1]
+            self._results[key] = (result, size)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._results.popitem(last=False)
+                self._bytes -= evicted
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def _write(self, key, content):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written to a temporary file first, so other processes never read half a result
+        tmp = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        with open(tmp, 'w') as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % _PRUNE_EVERY == 0
+        if prune and self.directory_max_bytes:
+            self.prune()
+
+    def prune(self):
+        """Delete the oldest result files until the directory is below 90% of its limit."""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.directory_max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.disk_hits + self.misses
+            return {
+                'items': len(self._results),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / requests if requests else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            config = current_app.config
+            _cache = ResultCache(
+                config['GEOAPI_CACHE_MAX_BYTES'],
+                config['GEOAPI_CACHE_DIR'],
+                config['GEOAPI_CACHE_DIR_MAX_BYTES'],
+            )
+
+        return _cache
+
+
+def cached_compute(fn, *args, vertices):
+    """
+    compute(fn, *args, vertices=vertices), unless the same computation's result is cached.
+    """
+    # geometries beyond GEOAPI_MAX_VERTICES are rejected before spending any time on hashing them
+    check_vertices(vertices)
+
+    cache = get_cache()
+    key = result_key(fn, *args)
+
+    found, result = cache.get(key)
+    if not found:
+        result = compute(fn, *args, vertices=vertices)
+        cache.set(key, result)
+
+    return result
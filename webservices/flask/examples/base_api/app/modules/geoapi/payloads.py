@@ -0,0 +1,304 @@
+# encoding: utf-8
+"""
+GeoAPI payloads
+---------------
+
+Reading and writing the JSON of the GeoAPI endpoints.
+
+The coordinates of a request are checked and converted to numpy arrays in one pass, instead
+of validating them against the JSON schema of the models first: jsonschema checks every
+single number of a large linestring one by one, which took longer than measuring it.
+
+JSON is read and written with orjson, if it is installed, else with the standard library.
+
+Instead of GeoJSON, the geometries can be sent as WKB or FlatGeobuf, see request_feature():
+they are read by shapely (FlatGeobuf through pyogrio, if it is installed) and their
+coordinates taken as arrays, without any Python list in between.
+"""
+import json
+from http import HTTPStatus
+from io import BytesIO
+
+import numpy as np
+import shapely.wkb
+from flask import current_app, make_response, request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from pyogrio.raw import read as read_ogr
+except ImportError:
+    read_ogr = None
+
+WKB_MIMETYPE = 'application/wkb'
+FLATGEOBUF_MIMETYPE = 'application/flatgeobuf'
+
+
+class InvalidPayload(ValueError):
+    """A request body not matching its model, with the error per path as flask_restplus reports them."""
+    code = HTTPStatus.BAD_REQUEST
+
+    def __init__(self, path, message):
+        super().__init__('{}: {}'.format(path, message))
+        self.errors = {path: message}
+
+
+class UnsupportedPayload(InvalidPayload):
+    code = HTTPStatus.UNSUPPORTED_MEDIA_TYPE
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value):
+    """value as a JSON string, numpy arrays and numbers included."""
+    if orjson is not None:
+        try:
+            # the representation of every namespace (and of swagger.json), so keys may be numbers, too
+            return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            # e.g. integers beyond 64 bits, which the standard library writes as they are
+            pass
+    return json.dumps(value, default=_to_builtin)
+
+
+def _to_builtin(value):
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def output_json(data, code, headers=None):
+    """
+    The API's representation of application/json, like flask_restplus' own but with dumps().
+    """
+    response = make_response(dumps(data) + '\n', code)
+    response.headers.extend(headers or {})
+    return response
+
+
+def request_body():
+    """
+    The raw body of the current request, raises RequestEntityTooLarge (413) beyond MAX_CONTENT_LENGTH.
+
+    Werkzeug only enforces MAX_CONTENT_LENGTH while parsing form data, get_data() reads bodies
+    of any length. Bodies announcing a larger Content-Length are rejected before reading them,
+    bodies without one (chunked) once they grow beyond the limit.
+    """
+    limit = current_app.config['MAX_CONTENT_LENGTH']
+    if limit is None:
+        return request.get_data(cache=False)
+    if request.content_length is not None and request.content_length > limit:
+        raise RequestEntityTooLarge()
+
+    data = request.stream.read(limit + 1)
+    if len(data) > limit:
+        raise RequestEntityTooLarge()
+    return data
+
+
+def request_json():
+    """
+    The JSON body of the current request.
+    """
+    if not request.is_json:
+        raise UnsupportedPayload('body', 'The request needs a JSON body, with Content-Type application/json.')
+    try:
+        return loads(request_body())
+    except ValueError as err:
+        raise InvalidPayload('body', 'Not valid JSON: {}'.format(err))
+
+
+def _member(value, key, path, kind=dict):
+    if not isinstance(value, dict) or key not in value:
+        raise InvalidPayload(path, "'{}' is a required property".format(key))
+    member = value[key]
+    if not isinstance(member, kind):
+        raise InvalidPayload('{}.{}'.format(path, key) if path else key,
+                             '{!r} is not of type {!r}'.format(member, 'object' if kind is dict else 'array'))
+    return member
+
+
+def parse_positions(value, path):
+    """
+    GeoJSON positions as an (n, 2) float array of [lng, lat], further dimensions dropped.
+
+    numpy checks the structure while converting: anything but a list of lists of at least two
+    numbers each ends up as an array of another shape or type, and is rejected.
+    """
+    if not isinstance(value, list):
+        raise InvalidPayload(path, '{!r} is not of type {!r}'.format(value, 'array'))
+    if not value:
+        return np.empty((0, 2))
+
+    try:
+        array = np.array(value)
+    except ValueError:
+        # positions of differing dimensions, with numpy >= 1.24
+        array = None
+    # (booleans next to numbers pass as 0 and 1, like Python's own arithmetic)
+    if array is None or array.dtype.kind not in 'iuf' or array.ndim != 2 or array.shape[1] < 2:
+        raise InvalidPayload(path, 'Positions have to be arrays of at least 2 numbers, [lng, lat].')
+    if array.dtype.kind != 'f' or array.shape[1] != 2:
+        array = array[:, :2].astype(float)
+    if not np.isfinite(array).all():
+        raise InvalidPayload(path, 'Positions have to be finite numbers.')
+
+    return array
+
+
+def parse_polygon(value, path):
+    """
+    The rings of a GeoJSON polygon, see parse_positions(): its exterior ring, or all of its rings.
+    """
+    if isinstance(value, list) and value and isinstance(value[0], list) and value[0] and isinstance(value[0][0], list):
+        return [parse_positions(ring, '{}.{}'.format(path, i)) for i, ring in enumerate(value)]
+    return parse_positions(value, path)
+
+
+def feature_coordinates(body, geometry_coordinates=parse_positions):
+    """
+    The coordinates of a GeoJSON Feature's geometry, converted by `geometry_coordinates`.
+    """
+    geometry = _member(body, 'geometry', '')
+    return geometry_coordinates(_member(geometry, 'coordinates', 'geometry', list), 'geometry.coordinates')
+
+
+def collection_coordinates(body, geometry_coordinates=parse_positions):
+    """
+    The coordinates of the geometries of a GeoJSON FeatureCollection's features, see feature_coordinates().
+    """
+    coordinates = []
+    for i, feature in enumerate(_member(body, 'features', '', list)):
+        path = 'features.{}.geometry'.format(i)
+        geometry = _member(feature, 'geometry', 'features.{}'.format(i))
+        coordinates.append(geometry_coordinates(_member(geometry, 'coordinates', path, list), path + '.coordinates'))
+    return coordinates
+
+
+def vertices(coordinates):
+    """
+    The number of positions in coordinates converted by the functions above.
+    """
+    if isinstance(coordinates, np.ndarray):
+        return len(coordinates)
+    return sum(vertices(c) for c in coordinates)
+
+
+def _geometry_coordinates(geometry, path):
+    # the coordinates of shapely geometries as arrays, like parse_positions() and parse_polygon()
+    if geometry.geom_type == 'Polygon':
+        rings = [geometry.exterior] + list(geometry.interiors)
+        return [_coordinates_array(ring.coords, '{}.{}'.format(path, i)) for i, ring in enumerate(rings)]
+    if geometry.geom_type == 'Point' and geometry.is_empty:
+        raise InvalidPayload(path, 'The point is empty.')
+    return _coordinates_array(geometry.coords, path)
+
+
+def _coordinates_array(coords, path):
+    array = np.asarray(coords, dtype=float)
+    if array.size == 0:
+        return np.empty((0, 2))
+    array = array[:, :2]
+    if not np.isfinite(array).all():
+        raise InvalidPayload(path, 'Positions have to be finite numbers.')
+    return array
+
+
+def _read_geometries(data, mimetype):
+    if mimetype == WKB_MIMETYPE:
+        try:
+            geometry = shapely.wkb.loads(data)
+        except Exception as err:
+            raise InvalidPayload('body', 'Not valid WKB: {}'.format(err))
+        # the parts of a Multi* geometry or a GeometryCollection are the geometries
+        return list(geometry.geoms) if hasattr(geometry, 'geoms') else [geometry]
+
+    if read_ogr is None:
+        raise UnsupportedPayload('body', 'FlatGeobuf needs pyogrio, which is not installed.')
+    try:
+        # (meta, fids, geometries, fields), only the geometries are read, as WKB
+        geometries = read_ogr(BytesIO(data), columns=[])[-2]
+    except Exception as err:
+        raise InvalidPayload('body', 'Not valid FlatGeobuf: {}'.format(err))
+    return [shapely.wkb.loads(bytes(wkb)) if wkb is not None else None for wkb in geometries]
+
+
+def request_geometries(geometry_type):
+    """
+    The coordinates of the geometries of the current request's binary body, of `geometry_type`
+    (e.g. 'Polygon'), as converted by parse_positions() or parse_polygon().
+    """
+    geometries = _read_geometries(request_body(), request.mimetype)
+
+    coordinates = []
+    for i, geometry in enumerate(geometries):
+        path = 'geometries.{}'.format(i)
+        geom_type = geometry.geom_type if geometry is not None else None
+        if geom_type != geometry_type:
+            raise InvalidPayload(path, '{} is not a {}'.format(geom_type, geometry_type))
+        coordinates.append(_geometry_coordinates(geometry, path))
+    return coordinates
+
+
+def is_binary_request():
+    return request.mimetype in (WKB_MIMETYPE, FLATGEOBUF_MIMETYPE)
+
+
+def request_feature(geometry_type, geometry_coordinates=parse_positions):
+    """
+    The coordinates of the geometry of the current request, according to its Content-Type:
+
+    - application/json: a GeoJSON Feature, see feature_coordinates()
+    - application/wkb: a WKB geometry of `geometry_type`
+    - application/flatgeobuf: a FlatGeobuf of a single feature of `geometry_type`
+    """
+    if not is_binary_request():
+        return feature_coordinates(request_json(), geometry_coordinates)
+
+    geometries = request_geometries(geometry_type)
+    if len(geometries) != 1:
+        raise InvalidPayload('body', 'One {} expected, got {} geometries.'.format(geometry_type, len(geometries)))
+    return geometries[0]
+
+
+def request_collection(geometry_type, geometry_coordinates=parse_positions):
+    """
+    The coordinates of all geometries of the current request, according to its Content-Type:
+
+    - application/json: a GeoJSON FeatureCollection, see collection_coordinates()
+    - application/wkb: a WKB Multi* geometry or GeometryCollection of `geometry_type` parts
+    - application/flatgeobuf: a FlatGeobuf of features of `geometry_type`
+    """
+    if not is_binary_request():
+        return collection_coordinates(request_json(), geometry_coordinates)
+    return request_geometries(geometry_type)
+
+
+def request_points():
+    """
+    The origins and destinations of a distance matrix in the current request, as (n, 2) arrays:
+
+    - application/json: {"origins": [...], "destinations": [...]}, without destinations, the
+      origins are the destinations too
+    - application/wkb, application/flatgeobuf: a MultiPoint, or features of points, which are
+      both the origins and the destinations
+    """
+    if is_binary_request():
+        points = request_geometries('Point')
+        points = np.concatenate(points) if points else np.empty((0, 2))
+        return points, points
+
+    body = request_json()
+    if not isinstance(body, dict):
+        raise InvalidPayload('', "'origins' is a required property")
+    origins = parse_positions(body.get('origins'), 'origins')
+    destinations = parse_positions(body['destinations'], 'destinations') if body.get('destinations') else origins
+    return origins, destinations
@@ -4,19 +4,25 @@
 RESTful API GeoAPI resources
 --------------------------
 """
-from functools import partial
 from http import HTTPStatus
 
 import geopy.distance
-import pyproj
-from flask import request
+import ijson
+from flask import Response, request, stream_with_context
 from flask_restplus import Namespace, Resource, abort
 from flask_restplus import fields
-from geopy import Point as GeopyPoint, distance
-from shapely.geometry import Polygon, LineString
-from shapely.ops import transform
+from geopy import Point as GeopyPoint
+from shapely.geometry import LineString
+from werkzeug.wsgi import get_input_stream
 
 from app.modules.geoapi import GeoApiNamespace
+from app.modules.geoapi.executor import GeometryRejected
+from app.modules.geoapi.geometry import distance_matrix, line_length, line_lengths, polygon_area, polygon_areas
+from app.modules.geoapi.memo import cached_compute, get_cache
+from app.modules.geoapi.payloads import (
+    InvalidPayload, dumps, parse_polygon, request_collection, request_feature, request_points, vertices
+)
+from app.modules.geoapi.streaming import measure_features
 
 api = Namespace('geoapi', description=GeoApiNamespace.description)
 
@@ -29,18 +35,24 @@ bounding_box = api.model('BoundingBox', {
 
 polygon = api.model('PolygonGeometry', {
     'type': fields.String(required=True, default="Polygon"),
-    'coordinates': fields.List(fields.List(fields.Float, required=True, type="Array"),
-                               required=True, type="Array", default=[[13.4197998046875, 52.52624809700062],
-                                                                     [13.387527465820312, 52.53084314728766],
-                                                                     [13.366928100585938, 52.50535544522142],
-                                                                     [13.419113159179688, 52.501175722709434],
-                                                                     [13.4197998046875, 52.52624809700062]])
+    # the rings, exterior first (the exterior ring on its own is accepted, too)
+    'coordinates': fields.List(fields.List(fields.List(fields.Float, required=True, type="Array"), type="Array"),
+                               required=True, type="Array", default=[[[13.4197998046875, 52.52624809700062],
+                                                                      [13.387527465820312, 52.53084314728766],
+                                                                      [13.366928100585938, 52.50535544522142],
+                                                                      [13.419113159179688, 52.501175722709434],
+                                                                      [13.4197998046875, 52.52624809700062]]])
 })
 polygon_feature = api.model('PolygonFeature', {
     'type': fields.String(default="Feature", require=True),
     'geometry': fields.Nested(polygon, required=True)
 })
 
+polygon_feature_collection = api.model('PolygonFeatureCollection', {
+    'type': fields.String(default="FeatureCollection", require=True),
+    'features': fields.List(fields.Nested(polygon_feature), required=True)
+})
+
 linestring = api.model('LineStringGeometry', {
     'type': fields.String(required=True, default="LineString"),
     'coordinates': fields.List(fields.List(fields.Float, required=True, type="Array"),
@@ -54,6 +66,11 @@ linestring_feature = api.model('LineStringFeature', {
     'geometry': fields.Nested(linestring, required=True)
 })
 
+linestring_feature_collection = api.model('LineStringFeatureCollection', {
+    'type': fields.String(default="FeatureCollection", require=True),
+    'features': fields.List(fields.Nested(linestring_feature), required=True)
+})
+
 point = api.model('PointGeometry', {
     'type': fields.String(required=True, default="Point"),
     'coordinates': fields.List(fields.List(fields.Float, required=True, type="Array"),
@@ -65,32 +82,69 @@ point_feature = api.model('PointFeature', {
     'geometry': fields.Nested(point, required=True)
 })
 
+distance_matrix_request = api.model('DistanceMatrixRequest', {
+    'origins': fields.List(fields.List(fields.Float, required=True, type="Array"),
+                           required=True, type="Array", default=[[13.4197998046875, 52.52624809700062],
+                                                                 [13.366928100585938, 52.50535544522142]]),
+    'destinations': fields.List(fields.List(fields.Float, required=True, type="Array"),
+                                type="Array", default=[[13.421173095703125, 52.49532344352079]])
+})
+
+@api.errorhandler(GeometryRejected)
+def handle_geometry_rejected(error):
+    return {'message': str(error)}, error.code
+
+@api.errorhandler(InvalidPayload)
+def handle_invalid_payload(error):
+    return {'errors': error.errors, 'message': 'Input payload validation failed'}, error.code
+
 @api.route('/polygon/area/')
 class PolygonArea(Resource):
     """
     Return the area of a polygon in m²
     """
 
-    @api.expect(polygon_feature, validate=True)
+    @api.expect(polygon_feature)
     @api.doc(id='polygon_area')
     def post(self):
         """
          Return the area of a polygon in m²
+
+         Instead of a GeoJSON Feature, the polygon can be sent as WKB (Content-Type application/wkb) or as a
+         FlatGeobuf of one feature (application/flatgeobuf).
+        """
+
+        coordinates = request_feature('Polygon', parse_polygon)
+        try:
+            return cached_compute(polygon_area, coordinates, vertices=vertices(coordinates))
+        except GeometryRejected:
+            raise
+        except Exception as err:
+            abort(HTTPStatus.UNPROCESSABLE_ENTITY, message="The GeoJSON polygon couldn't be processed.", error=str(err))
+
+@api.route('/polygon/areas/')
+class PolygonAreas(Resource):
+    """
+    Return the areas of all polygons of a FeatureCollection in m²
+    """
+
+    @api.expect(polygon_feature_collection)
+    @api.doc(id='polygon_areas')
+    def post(self):
         """
+         Return the areas of all polygons of a FeatureCollection in m², in the order of the features
 
+         Instead of a GeoJSON FeatureCollection, the polygons can be sent as a WKB MultiPolygon (Content-Type
+         application/wkb) or as a FlatGeobuf (application/flatgeobuf).
+        """
+
+        polygons = request_collection('Polygon', parse_polygon)
         try:
-            projection = partial(
-                pyproj.transform,
-                pyproj.Proj(init='epsg:4326'),
-                pyproj.Proj(init='epsg:3035')
-            )
-
-            return transform(
-              projection,
-              Polygon(request.json['geometry']['coordinates'])
-            ).area
+            return cached_compute(polygon_areas, polygons, vertices=vertices(polygons))
+        except GeometryRejected:
+            raise
         except Exception as err:
-            abort(HTTPStatus.UNPROCESSABLE_ENTITY, message="The GeoJSON polygon couldn't be processed.", error=err)
+            abort(HTTPStatus.UNPROCESSABLE_ENTITY, message="The GeoJSON polygons couldn't be processed.", error=str(err))
 
 @api.route('/point/distance/')
 @api.param('start_lat', 'Latitude of the start point e.g. 52.52624809700062', _in="query")
@@ -133,21 +187,113 @@ class LinestringLength(Resource):
     Return if the length in meter of a given GeoJSON LineString
     """
 
-    @api.expect(linestring_feature, validate=True)
+    @api.expect(linestring_feature)
     @api.doc(id='linestring_length')
     def post(self):
         """
         Return if the length in meter of a given GeoJSON LineString
+
+        Instead of a GeoJSON Feature, the linestring can be sent as WKB (Content-Type application/wkb) or as a
+        FlatGeobuf of one feature (application/flatgeobuf).
         """
+        coordinates = request_feature('LineString')
         try:
-            line_coordinates = request.json['geometry']['coordinates']
-            length = 0
-            for idx in range(len(line_coordinates) - 1):
-                length += distance.distance(
-                    line_coordinates[idx], line_coordinates[idx + 1]
-                ).meters
-            return length
+            return cached_compute(line_length, coordinates, vertices=vertices(coordinates))
+        except GeometryRejected:
+            raise
         except Exception as err:
             pass
         abort(HTTPStatus.BAD_REQUEST,
-              message="Please provide a valid POST GeoJSON and valid query with the following url arguments.")
\ No newline at end of file
+              message="Please provide a valid POST GeoJSON and valid query with the following url arguments.")
+
+@api.route('/linestring/lengths/')
+class LinestringLengths(Resource):
+    """
+    Return the lengths in meter of all LineStrings of a GeoJSON FeatureCollection
+    """
+
+    @api.expect(linestring_feature_collection)
+    @api.doc(id='linestring_lengths')
+    def post(self):
+        """
+        Return the lengths in meter of all LineStrings of a GeoJSON FeatureCollection, in the order of the features
+
+        Instead of a GeoJSON FeatureCollection, the linestrings can be sent as a WKB MultiLineString (Content-Type
+        application/wkb) or as a FlatGeobuf (application/flatgeobuf).
+        """
+        lines = request_collection('LineString')
+        try:
+            return cached_compute(line_lengths, lines, vertices=vertices(lines))
+        except GeometryRejected:
+            raise
+        except Exception as err:
+            abort(HTTPStatus.BAD_REQUEST, message="The GeoJSON linestrings couldn't be processed.", error=str(err))
+
+@api.route('/point/distances/')
+class PointDistanceMatrix(Resource):
+    """
+    Return the distances in kilometers between many points.
+    """
+
+    @api.expect(distance_matrix_request)
+    @api.doc(id='point_distance_matrix')
+    def post(self):
+        """
+        Return the distances in kilometers from every origin (rows) to every destination (columns).
+
+        Points are given as [lng, lat]. Without destinations, the distances between all origins are returned.
+        Instead of JSON, the points can be sent as a WKB MultiPoint (Content-Type application/wkb) or as a
+        FlatGeobuf (application/flatgeobuf), the distances between all of them are returned.
+        """
+        origins, destinations = request_points()
+        try:
+            # every pair is computed
+            return cached_compute(distance_matrix, origins, destinations, vertices=len(origins) * len(destinations))
+        except GeometryRejected:
+            raise
+        except Exception as err:
+            abort(HTTPStatus.BAD_REQUEST, message="The points couldn't be processed.", error=str(err))
+
+@api.route('/features/measure/stream/')
+class StreamedFeatureMeasurements(Resource):
+    """
+    Return the area or length of every feature of a GeoJSON FeatureCollection as newline-delimited JSON
+    """
+
+    @api.doc(id='stream_feature_measurements')
+    def post(self):
+        """
+        Return the area in m² of every Polygon and the length in meter of every LineString of a GeoJSON FeatureCollection.
+
+        The upload is read and measured while it arrives, and results are sent back right away, one JSON object per
+        line and feature: {"index": 0, "id": "...", "area": 1.0} or {"index": 1, "length": 1.0}. Features which
+        couldn't be measured get an "error" instead.
+        """
+
+        def generate():
+            try:
+                # the raw body, read chunk by chunk: request.json would read all of it into
+                # memory first. MAX_CONTENT_LENGTH doesn't apply, memory stays flat however large.
+                for result in measure_features(get_input_stream(request.environ)):
+                    yield dumps(result) + '\n'
+            except ijson.JSONError as err:
+                # the response has already started, so the error can only be reported in its body
+                yield dumps({'error': "The GeoJSON couldn't be parsed: {}".format(err)}) + '\n'
+            except GeometryRejected as err:
+                # too large, or out of time: the rest of the upload isn't read
+                yield dumps({'error': str(err)}) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@api.route('/cache/')
+class ResultCacheStats(Resource):
+    """
+    Return the statistics of this process' result cache
+    """
+
+    @api.doc(id='result_cache_stats')
+    def get(self):
+        """
+        Return the statistics of this process' result cache: its size, hits, misses and hit rate
+        """
+        return get_cache().stats()
@@ -0,0 +1,158 @@
+# encoding: utf-8
+"""
+GeoAPI streaming measurements
+-----------------------------
+
+Measures the features of a GeoJSON FeatureCollection while it is still being uploaded: the
+features are parsed one by one, measured in batches as soon as they arrived, and their results
+handed on right away, so memory doesn't grow with the size of the upload.
+"""
+import ijson
+from flask import current_app
+
+from app.modules.geoapi.executor import GeometryTooLarge, compute
+from app.modules.geoapi.geometry import line_lengths, polygon_areas
+
+# features measured together, large enough to profit from the array computations
+STREAM_BATCH_SIZE = 1000
+# bytes read from the upload at a time
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# geometry type -> (measurement, what is measured)
+MEASUREMENTS = {
+    'Polygon': (polygon_areas, 'area'),
+    'LineString': (line_lengths, 'length'),
+}
+
+
+def measure_batch(batch):
+    """
+    The results of a batch of (index, id, geometry) tuples, see measure_features().
+    """
+    results = [None] * len(batch)
+
+    for geometry_type, (measure, name) in MEASUREMENTS.items():
+        indices = [i for i, (_, _, geometry) in enumerate(batch) if geometry.get('type') == geometry_type]
+        if not indices:
+            continue
+        try:
+            values = measure([batch[i][2]['coordinates'] for i in indices])
+        except Exception:
+            # one broken geometry fails the whole batch, so these are measured one by one
+            values = []
+            for i in indices:
+                try:
+                    values.append(measure([batch[i][2]['coordinates']])[0])
+                except Exception as err:
+                    values.append(err)
+
+        for i, value in zip(indices, values):
+            results[i] = {name: value} if not isinstance(value, Exception) else {'error': str(value)}
+
+    return [
+        _result(item, result if result is not None else
+                {'error': "Unsupported geometry type {!r}.".format(item[2].get('type'))})
+        for item, result in zip(batch, results)
+    ]
+
+
+def geometry_vertices(geometry):
+    """
+    The number of positions of a GeoJSON geometry's coordinates, 0 for those which aren't measured.
+    """
+    coordinates = geometry.get('coordinates')
+    if geometry.get('type') not in MEASUREMENTS or not isinstance(coordinates, list) or not coordinates:
+        return 0
+    if geometry['type'] == 'Polygon' and isinstance(coordinates[0], list) and coordinates[0] and \
+            isinstance(coordinates[0][0], list):
+        return sum(len(ring) for ring in coordinates if isinstance(ring, list))
+    return len(coordinates)
+
+
+def read_feature_chunks(stream, chunk_size=STREAM_CHUNK_SIZE, max_feature_bytes=None):
+    """
+    Yield the features of the FeatureCollection read from `stream` in lists, one per chunk
+    read, as soon as they are parsed.
+
+    If the JSON turns out to be invalid, the features parsed before the error are yielded
+    first, then ijson's error is raised. A feature still incomplete after more than
+    `max_feature_bytes` raises GeometryTooLarge: it would have to be held in memory whole.
+    """
+    # pushing the chunks into the parser only ever calls read() with a size
+    features = ijson.sendable_list()
+    parser = ijson.items_coro(features, 'features.item', use_float=True)
+
+    # bytes read since the last complete feature
+    pending = 0
+    try:
+        chunk = stream.read(chunk_size)
+        while chunk:
+            parser.send(chunk)
+            if features:
+                yield list(features)
+                del features[:]
+                pending = 0
+            else:
+                pending += len(chunk)
+                if max_feature_bytes is not None and pending > max_feature_bytes:
+                    raise GeometryTooLarge('A feature is larger than {} bytes.'.format(max_feature_bytes))
+            chunk = stream.read(chunk_size)
+
+        parser.close()
+    except ijson.JSONError:
+        if features:
+            yield list(features)
+        raise
+
+    if features:
+        yield list(features)
+
+
+def _item(index, feature):
+    if not isinstance(feature, dict):
+        return index, None, {}
+    return index, feature.get('id'), feature.get('geometry') or {}
+
+
+def _result(item, result):
+    index, feature_id, _ = item
+    result['index'] = index
+    if feature_id is not None:
+        result['id'] = feature_id
+    return result
+
+
+def measure_features(stream, batch_size=STREAM_BATCH_SIZE):
+    """
+    Yield the area (polygons, in m²) or length (linestrings, in meters) of every feature of
+    the FeatureCollection read from `stream`, in the order of the features, along with the
+    feature's index and id, if it has one.
+
+    The features are measured in batches as soon as they are read, each batch run by
+    executor.compute(): large ones in the process pool, with its CPU time limit, which ends the
+    stream with GeometryTimeout. Features with more than
+    GEOAPI_MAX_VERTICES vertices get an error instead, and a feature larger than
+    MAX_CONTENT_LENGTH ends the stream with GeometryTooLarge.
+    """
+    config = current_app.config
+    max_vertices = config['GEOAPI_MAX_VERTICES']
+
+    first = 0
+    for features in read_feature_chunks(stream, max_feature_bytes=config['MAX_CONTENT_LENGTH']):
+        batch, vertices = [], 0
+        for item in (_item(index, feature) for index, feature in enumerate(features, first)):
+            count = geometry_vertices(item[2])
+            if batch and (len(batch) == batch_size or vertices + count > max_vertices):
+                yield from compute(measure_batch, batch, vertices=vertices)
+                batch, vertices = [], 0
+
+            if count > max_vertices:
+                yield _result(item, {'error': 'The geometry has {} vertices, at most {} are allowed.'.format(
+                    count, max_vertices)})
+            else:
+                batch.append(item)
+                vertices += count
+
+        if batch:
+            yield from compute(measure_batch, batch, vertices=vertices)
+        first += len(features)
@@ -0,0 +1,90 @@
+"""
+Cost of reading, validating and answering a linestring length request of 1k, 10k and 100k
+vertices: the JSON schema validation of flask_restplus (how LinestringLength used to check
+its input) against the checks of app/modules/geoapi/payloads.py, the standard library's json
+against orjson (if installed), reading the same linestring from WKB, and the geodesic length
+computation itself for comparison.
+
+    python benchmarks/payloads.py
+"""
+import argparse
+import json
+import math
+import sys
+import time
+from pathlib import Path
+
+import shapely.wkb
+from shapely.geometry import LineString
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import create_app  # noqa: E402
+from app.extensions.api import api_v1  # noqa: E402
+from app.modules.geoapi import payloads  # noqa: E402
+from app.modules.geoapi.geometry import line_length  # noqa: E402
+from app.modules.geoapi.resources import linestring_feature  # noqa: E402
+
+
+def linestring(vertices):
+    """A GeoJSON Feature of a wavy linestring through Berlin."""
+    coordinates = [[13.4 + 0.2 * i / vertices, 52.5 + 0.01 * math.sin(i / 10)] for i in range(vertices)]
+    return {'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': coordinates}}
+
+
+def timed(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main(args):
+    app = create_app('production')
+    client = app.test_client()
+
+    print('Milliseconds per request, orjson {}'.format('installed' if payloads.orjson else 'not installed'))
+    columns = ['json.loads', 'loads', 'jsonschema', 'lean check', 'wkb read', 'length', 'request', 'wkb request']
+    print('{:>10}'.format('vertices') + ''.join('{:>12}'.format(column) for column in columns))
+
+    sizes = []
+    for vertices in args.vertices:
+        feature = linestring(vertices)
+        body = json.dumps(feature).encode()
+        wkb = LineString(feature['geometry']['coordinates']).wkb
+        repeat = max(1, args.repeat * 1000 // vertices)
+
+        with app.test_request_context():
+            times = [
+                timed(lambda: json.loads(body), repeat),
+                timed(lambda: payloads.loads(body), repeat),
+                timed(lambda: linestring_feature.validate(feature, api_v1.refresolver, api_v1.format_checker), repeat),
+                timed(lambda: payloads.feature_coordinates(feature), repeat),
+                timed(lambda: payloads._geometry_coordinates(shapely.wkb.loads(wkb), ''), repeat),
+                timed(lambda: line_length(payloads.feature_coordinates(feature)), repeat),
+            ]
+        # the whole request, with a new geometry every time so the result cache doesn't answer
+        features = [json.dumps(linestring(vertices + i)).encode() for i in range(repeat + 1)]
+        bodies = iter(features)
+        times.append(timed(lambda: client.post('/api/v1/geoapi/linestring/length/', data=next(bodies),
+                                                content_type='application/json'), repeat))
+        wkbs = iter([LineString(linestring(vertices + repeat + 1 + i)['geometry']['coordinates']).wkb
+                     for i in range(repeat + 1)])
+        times.append(timed(lambda: client.post('/api/v1/geoapi/linestring/length/', data=next(wkbs),
+                                                content_type=payloads.WKB_MIMETYPE), repeat))
+
+        print('{:>10}'.format(vertices) + ''.join('{:>12.2f}'.format(t) for t in times))
+        sizes.append((vertices, len(body), len(wkb)))
+
+    print('\nRequest body size in kB')
+    for vertices, json_size, wkb_size in sizes:
+        print('{:>10}: GeoJSON {:10.1f}   WKB {:10.1f}'.format(vertices, json_size / 1000, wkb_size / 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vertices', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=20, help='per thousand vertices')
+
+    main(parser.parse_args())
@@ -0,0 +1,123 @@
+"""
+Accuracy and speed of the polygon area computation: per request EPSG:3035 (how PolygonArea
+used to work), a cached EPSG:3035 transformer, and the cached equal-area projection centred
+on each polygon (how it works now).
+
+The reference is the area on the WGS84 ellipsoid from pyproj.Geod. EPSG:3035 is only meant
+for Europe, its errors grow with the distance from it.
+
+    python benchmarks/polygon_area.py
+"""
+import argparse
+import math
+import sys
+import time
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pyproj
+from shapely.geometry import Polygon
+from shapely.ops import transform
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.modules.geoapi import geometry  # noqa: E402
+from app.modules.geoapi.geometry import _projected_areas, polygon_areas, polygon_rings  # noqa: E402
+
+PLACES = {
+    'Berlin': (13.40, 52.52),
+    'Lisbon': (-9.14, 38.72),
+    'Reykjavik': (-21.94, 64.15),
+    'New York': (-74.01, 40.71),
+    'Nairobi': (36.82, -1.29),
+    'Tokyo': (139.69, 35.69),
+    'Sydney': (151.21, -33.87),
+    'Fiji': (179.90, -17.00),  # crossing the antimeridian
+}
+
+_geod = pyproj.Geod(ellps='WGS84')
+_cached_3035 = pyproj.Transformer.from_crs('epsg:4326', 'epsg:3035', always_xy=True)
+
+
+def circle(lng, lat, radius_km, vertices):
+    """A polygon approximating a circle, its vertices on geodesics from the centre."""
+    azimuths = np.linspace(0, 360, vertices, endpoint=False)
+    lngs, lats, _ = _geod.fwd(np.full(vertices, lng), np.full(vertices, lat), azimuths, np.full(vertices, radius_km * 1000))
+    ring = np.column_stack([lngs, lats]).tolist()
+    return ring + ring[:1]
+
+
+def reference_area(coordinates):
+    ring = np.asarray(coordinates)
+    return abs(_geod.polygon_area_perimeter(ring[:, 0], ring[:, 1])[0])
+
+
+def per_request_3035(coordinates):
+    # as PolygonArea used to do it: two Proj objects and pyproj.transform, on every request
+    projection = partial(
+        pyproj.transform,
+        pyproj.Proj(init='epsg:4326'),
+        pyproj.Proj(init='epsg:3035')
+    )
+    return transform(projection, Polygon(coordinates)).area
+
+
+def cached_3035(coordinates):
+    return _projected_areas(_cached_3035, [polygon_rings(coordinates)])[0]
+
+
+def centred(coordinates):
+    return polygon_areas([coordinates])[0]
+
+
+VARIANTS = {
+    'per request 3035': per_request_3035,
+    'cached 3035': cached_3035,
+    'centred laea': centred,
+}
+
+
+def timed(fn, polygons, repeat):
+    # the first call per region builds the centred transformer, that's not what is measured
+    for coordinates in polygons:
+        fn(coordinates)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for coordinates in polygons:
+            fn(coordinates)
+    return (time.perf_counter() - start) / (repeat * len(polygons)) * 1e6
+
+
+def main(args):
+    print('Relative error against the ellipsoidal area, {} km radius, {} vertices'.format(args.radius, args.vertices))
+    print('{:>12}'.format('') + ''.join('{:>18}'.format(name) for name in VARIANTS))
+    for place, (lng, lat) in PLACES.items():
+        coordinates = circle(lng, lat, args.radius, args.vertices)
+        reference = reference_area(coordinates)
+        errors = [abs(fn(coordinates) - reference) / reference for fn in VARIANTS.values()]
+        print('{:>12}'.format(place) + ''.join('{:>18.2e}'.format(error) for error in errors))
+
+    polygons = [circle(lng, lat, args.radius, args.vertices) for lng, lat in PLACES.values()]
+    print('\nMicroseconds per polygon, one polygon per call')
+    for name, fn in VARIANTS.items():
+        print('{:>18}: {:10.1f}'.format(name, timed(fn, polygons, args.repeat)))
+
+    batch = polygons * math.ceil(args.batch / len(polygons))
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        polygon_areas(batch)
+    print('{:>18}: {:10.1f}  ({} polygons per call)'.format(
+        'centred, batch', (time.perf_counter() - start) / (args.repeat * len(batch)) * 1e6, len(batch)))
+    print('\nTransformer cache of this thread: {}'.format(geometry._local.equal_area_transformers.cache_info()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--radius', type=float, default=5, help='of the test polygons, in km')
+    parser.add_argument('--vertices', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--batch', type=int, default=1000)
+
+    main(parser.parse_args())
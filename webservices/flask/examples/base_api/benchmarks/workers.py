@@ -0,0 +1,137 @@
+"""
+Latency of small requests while large ones are being processed, for several gunicorn worker
+models: small polygon areas are requested continuously, while a few clients keep sending
+long linestrings at the same time.
+
+    python benchmarks/workers.py --duration 20
+
+Every strategy gets its own gunicorn, started with gunicorn.conf.py and the strategy's
+settings from the environment. The result cache is turned off: every request sends the same
+geometry, which would otherwise be computed once and then only looked up.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+BASE_API = Path(__file__).resolve().parents[1]
+CORES = multiprocessing.cpu_count()
+
+# for all strategies, see config.py
+NO_RESULT_CACHE = {'GEOAPI_CACHE_MAX_BYTES': '0', 'GEOAPI_CACHE_DIR': ''}
+
+# name -> gunicorn settings, see gunicorn.conf.py
+STRATEGIES = {
+    '1 sync worker': {'GUNICORN_WORKERS': '1', 'GUNICORN_WORKER_CLASS': 'sync'},
+    '1 worker, 4 threads': {'GUNICORN_WORKERS': '1', 'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_THREADS': '4'},
+    '{} sync workers'.format(CORES): {'GUNICORN_WORKERS': str(CORES), 'GUNICORN_WORKER_CLASS': 'sync'},
+    '{} workers, 2 threads'.format(CORES): {
+        'GUNICORN_WORKERS': str(CORES), 'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_THREADS': '2'},
+}
+
+SMALL_POLYGON = {'type': 'Feature', 'geometry': {'type': 'Polygon', 'coordinates': [
+    [13.4197998046875, 52.52624809700062], [13.387527465820312, 52.53084314728766],
+    [13.366928100585938, 52.50535544522142], [13.419113159179688, 52.501175722709434],
+    [13.4197998046875, 52.52624809700062]]}}
+
+
+def long_linestring(vertices):
+    return {'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': [
+        [13.4 + 0.1 * math.cos(i / 100), 52.5 + 0.05 * math.sin(i / 100)] for i in range(vertices)]}}
+
+
+def post(url, body):
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=120) as response:
+        response.read()
+    return (time.perf_counter() - start) * 1000
+
+
+def client(url, body, deadline, latencies):
+    while time.perf_counter() < deadline:
+        try:
+            latencies.append(post(url, body))
+        except (urllib.error.URLError, OSError):
+            latencies.append(None)
+
+
+def wait_until_up(base_url, process):
+    for _ in range(100):
+        if process.poll() is not None:
+            raise SystemExit('gunicorn exited with {}'.format(process.returncode))
+        try:
+            urllib.request.urlopen(base_url + '/api/v1/swagger.json', timeout=1).read()
+            return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    raise SystemExit('gunicorn did not come up')
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(name, settings, args):
+    base_url = 'http://127.0.0.1:{}'.format(args.port)
+    env = dict(os.environ, GUNICORN_BIND='127.0.0.1:{}'.format(args.port), GUNICORN_ACCESSLOG='', **NO_RESULT_CACHE, **settings)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', 'wsgi:app'], cwd=BASE_API, env=env)
+    try:
+        wait_until_up(base_url, process)
+
+        small, large = [], []
+        deadline = time.perf_counter() + args.duration
+        threads = [
+            threading.Thread(target=client, args=(
+                base_url + '/api/v1/geoapi/polygon/area/', json.dumps(SMALL_POLYGON).encode(), deadline, small))
+            for _ in range(args.clients)
+        ] + [
+            threading.Thread(target=client, args=(
+                base_url + '/api/v1/geoapi/linestring/length/', json.dumps(long_linestring(args.vertices)).encode(),
+                deadline, large))
+            for _ in range(args.large_clients)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        process.terminate()
+        process.wait()
+
+    ok = [latency for latency in small if latency is not None]
+    large_ok = [latency for latency in large if latency is not None]
+    print('{:>22}: {:7.1f} small/s | p50 {:8.1f} ms | p99 {:8.1f} ms | {:5.1f} large/s, mean {:8.1f} ms | {} errors'.format(
+        name, len(ok) / args.duration,
+        statistics.median(ok) if ok else math.nan, percentile(ok, 0.99) if ok else math.nan,
+        len(large_ok) / args.duration, statistics.mean(large_ok) if large_ok else math.nan,
+        len(small) - len(ok) + len(large) - len(large_ok)))
+
+
+def main(args):
+    print('{} cores, {} small clients, {} clients sending {} vertex linestrings'.format(
+        CORES, args.clients, args.large_clients, args.vertices))
+    for name, settings in STRATEGIES.items():
+        run(name, settings, args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=20, help='seconds per strategy')
+    parser.add_argument('--clients', type=int, default=8, help='sending small polygons')
+    parser.add_argument('--large-clients', type=int, default=2, help='sending long linestrings')
+    parser.add_argument('--vertices', type=int, default=20000, help='of the long linestrings')
+    parser.add_argument('--port', type=int, default=4010)
+
+    main(parser.parse_args())
@@ -1,3 +1,6 @@
+import os
+
+
 class BaseConfig(object):
     ENABLED_MODULES = {
         'api',
@@ -6,8 +9,47 @@ class BaseConfig(object):
 
     SWAGGER_UI_JSONEDITOR = True
 
+    # larger request bodies are rejected with 413 before they are read, see
+    # app/modules/geoapi/payloads.py; the streaming endpoint reads its body chunk by chunk and
+    # isn't limited
+    MAX_CONTENT_LENGTH = 64 * 1024 * 1024
+
+    # geometries with at least this many vertices are computed in a process pool, see
+    # app/modules/geoapi/executor.py, and geometries with more than GEOAPI_MAX_VERTICES are rejected
+    GEOAPI_OFFLOAD_VERTICES = 20000
+    GEOAPI_MAX_VERTICES = 2000000
+    # per server process: gunicorn already runs a worker per core, each with a pool of its own
+    GEOAPI_PROCESSES = 1
+    # seconds of CPU time a computation in the pool may take, and seconds a request waits for it
+    GEOAPI_CPU_TIMEOUT = 10
+    GEOAPI_WAIT_TIMEOUT = 30
+
+    # results of geometry computations are kept in memory up to this many bytes (as JSON, 0
+    # keeps none), and, if the GEOAPI_CACHE_DIR environment variable is set, in that directory,
+    # shared by all processes
+    GEOAPI_CACHE_MAX_BYTES = int(os.environ.get('GEOAPI_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    GEOAPI_CACHE_DIR = os.environ.get('GEOAPI_CACHE_DIR') or None
+    GEOAPI_CACHE_DIR_MAX_BYTES = 1024 * 1024 * 1024
+
 
 class DevelopmentConfig(BaseConfig):
     """config for DevelopmentConfig."""
     DEBUG = False
     DEVELOPMENT = True
+
+
+class ProductionConfig(BaseConfig):
+    """config for ProductionConfig, served by gunicorn (see gunicorn.conf.py)."""
+    DEBUG = False
+    DEVELOPMENT = False
+
+    # responses are serialized as they are, without sorting every object's keys first
+    JSON_SORT_KEYS = False
+    # 404s don't look for similar routes to suggest
+    ERROR_404_HELP = False
+
+
+CONFIG_NAME_MAPPER = {
+    'development': 'config.DevelopmentConfig',
+    'production': 'config.ProductionConfig',
+}
@@ -0,0 +1,15 @@
+# encoding: utf-8
+import pytest
+
+from app import create_app
+
+
+@pytest.fixture(scope='session')
+def app():
+    # the API's namespaces are module-level, they can only be registered with one app per process
+    return create_app('development')
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,33 @@
+"""
+gunicorn settings for the GeoAPI, every one of them can be overridden from the environment.
+
+The geometry endpoints are CPU-bound, and Python threads share one core because of the GIL.
+Parallelism therefore comes from worker processes, one per core: a slow polygon keeps one
+worker busy while the others go on serving. A couple of threads per worker keep small
+requests flowing while another thread of the same worker waits: on a slow client, or on a
+large geometry computed in the process pool (see app/modules/geoapi/executor.py). They add no
+CPU parallelism of their own.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:4000')
+
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 2))
+
+# workers stuck on a single request longer than this are killed and replaced
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# build the app once in the master, the forked workers share its memory
+preload_app = True
+
+# replace workers now and then, so no single worker grows forever
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+# an empty GUNICORN_ACCESSLOG turns the access log off
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-') or None
@@ -0,0 +1,28 @@
+# encoding: utf-8
+import numpy as np
+import pyproj
+import pytest
+
+from app.modules.geoapi.geometry import equal_area_centre, polygon_area
+
+_geod = pyproj.Geod(ellps='WGS84')
+
+
+def ellipsoidal_area(ring):
+    ring = np.asarray(ring, dtype=float)
+    return abs(_geod.polygon_area_perimeter(ring[:, 0], ring[:, 1])[0])
+
+
+@pytest.mark.parametrize('ring', [
+    [[13, 52], [14, 52], [14, 53], [13, 53], [13, 52]],
+    # crossing the antimeridian, from either side
+    [[179, 0], [-179, 0], [-179, 1], [179, 1], [179, 0]],
+    [[-179, -20], [179, -20], [179, -19], [-179, -19], [-179, -20]],
+])
+def test_polygon_area(ring):
+    assert polygon_area(ring) == pytest.approx(ellipsoidal_area(ring), rel=1e-3)
+
+
+def test_equal_area_centre_on_the_antimeridian():
+    ring = np.array([[179.6, 0], [-179.6, 0], [-179.6, 1], [179.6, 1], [179.6, 0]])
+    assert abs(equal_area_centre(ring)[0]) == 180.0
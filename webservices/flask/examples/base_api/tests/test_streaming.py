@@ -0,0 +1,93 @@
+# encoding: utf-8
+import io
+import json
+
+from app.modules.geoapi.streaming import measure_features
+
+URL = '/api/v1/geoapi/features/measure/stream/'
+
+RING = [[13.4197998046875, 52.52624809700062], [13.387527465820312, 52.53084314728766],
+        [13.366928100585938, 52.50535544522142], [13.419113159179688, 52.501175722709434],
+        [13.4197998046875, 52.52624809700062]]
+
+
+def feature_collection(count, coordinates=None):
+    return json.dumps({
+        'type': 'FeatureCollection',
+        'features': [{'type': 'Feature', 'id': i, 'geometry': {'type': 'Polygon', 'coordinates': coordinates or [RING]}}
+                     for i in range(count)],
+    })
+
+
+def lines(response):
+    return [json.loads(line) for line in response.data.decode().splitlines()]
+
+
+class RecordingStream(io.BytesIO):
+    """A request body whose reads are recorded, to tell what was read before a result came out."""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+
+def test_truncated_body_keeps_the_measured_features(client):
+    body = feature_collection(5)
+    # cut in the middle of the 6th feature
+    truncated = body[:-1].rsplit(']', 1)[0] + '], {"type": "Feature", "geometry": {"type": "Pol'
+
+    results = lines(client.post(URL, data=truncated, content_type='application/json'))
+
+    assert [result.get('id') for result in results[:-1]] == [0, 1, 2, 3, 4]
+    assert all(result['area'] > 0 for result in results[:-1])
+    assert 'error' in results[-1]
+
+
+def test_results_come_before_the_upload_ends(app):
+    stream = RecordingStream(feature_collection(1000).encode())
+
+    with app.app_context():
+        results = measure_features(stream, batch_size=1000)
+        next(results)
+        reads = stream.reads
+        rest = list(results)
+
+    assert len(rest) == 999
+    assert reads < stream.reads
+
+
+def test_features_beyond_the_vertex_limit_get_an_error(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'GEOAPI_MAX_VERTICES', 100)
+    body = json.loads(feature_collection(3))
+    body['features'][1]['geometry']['coordinates'] = [RING[:-1] * 30 + RING[:1]]
+
+    results = lines(client.post(URL, data=json.dumps(body), content_type='application/json'))
+
+    assert [result['index'] for result in results] == [0, 1, 2]
+    assert 'area' in results[0] and 'area' in results[2]
+    assert 'vertices' in results[1]['error']
+
+
+def test_a_feature_beyond_max_content_length_ends_the_stream(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 64 * 1024)
+    body = json.loads(feature_collection(2))
+    body['features'][1]['geometry']['coordinates'] = [RING[:-1] * 2000 + RING[:1]]
+
+    results = lines(client.post(URL, data=json.dumps(body), content_type='application/json'))
+
+    assert results[0]['id'] == 0
+    assert 'bytes' in results[-1]['error']
+
+
+def test_batches_run_in_the_process_pool(app, client, monkeypatch):
+    # every batch is offloaded, like large ones are
+    monkeypatch.setitem(app.config, 'GEOAPI_OFFLOAD_VERTICES', 1)
+
+    results = lines(client.post(URL, data=feature_collection(3), content_type='application/json'))
+
+    assert [result['id'] for result in results] == [0, 1, 2]
+    assert all(result['area'] > 0 for result in results)
@@ -0,0 +1,13 @@
+"""
+WSGI entry point for production servers, e.g.
+
+    gunicorn --config gunicorn.conf.py wsgi:app
+
+The app is created once at import. With gunicorn's preload_app, that happens once in the
+master process, and the forked workers share it instead of each building their own.
+"""
+import os
+
+from app import create_app
+
+app = create_app(os.environ.get('FLASK_CONFIG', 'production'))